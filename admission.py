@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+
+import os
+import time
+import threading
+
+SPEEDS = ('ultraBullet', 'bullet', 'blitz', 'rapid', 'classical')
+
+# What Bot.event does with a challenge
+ACCEPT  = 'accept'
+QUEUE   = 'queue'
+DECLINE = 'decline'
+
+
+def duration(challenge):
+    '''
+      Estimated length of the game of a challenge, as Lichess estimates it for
+      each player (initial time + 40 increments), for both players.
+        Input:
+             challenge (dictionary, as in the 'challenge' events)
+
+        Output:
+             seconds
+    '''
+    control = challenge.get('timeControl', {})
+    return 2 * (control.get('limit', 0) + 40 * control.get('increment', 0))
+
+
+class AdmissionControl(object):
+
+    def __init__(self, maxGames = None, queueSize = 8, queueTimeout = 30, speeds = SPEEDS, deadline = None):
+        '''
+          Decide which challenges a BOT accepts, so that the engines are not
+          oversubscribed: challenges beyond 'maxGames' live games wait in a
+          short queue, from which the fastest time controls are accepted first
+          as games end.
+            Input:
+                 maxGames (optional, live games at once; by default two per core,
+                           since each game uses an engine only on its turn)
+                queueSize (optional, challenges waiting for a free game, beyond which
+                           they are declined)
+             queueTimeout (optional, seconds a challenge waits before being declined)
+                   speeds (optional, accepted speeds, e.g. ('bullet', 'blitz'))
+                 deadline (optional, time.time() by which the BOT must be done
+                           playing: only games expected to end before are accepted)
+        '''
+        self.maxGames = maxGames or 2 * (os.cpu_count() or 1)
+        self.queueSize = queueSize
+        self.queueTimeout = queueTimeout
+        self.speeds = speeds
+        self.deadline = deadline
+
+        self.live = set()
+        self.queue = {}     # challenge id -> (duration, arrival, challenge)
+        self.lock = threading.Lock()
+        self.declined = 0
+
+
+    def fits(self, challenge):
+        return self.deadline is None or time.time() + duration(challenge) <= self.deadline
+
+
+    def offer(self, challenge):
+        '''
+          A challenge arrived: accept it (reserving a game), queue it or decline it.
+            Input:
+                 challenge (dictionary, as in the 'challenge' events)
+
+            Output:
+                 (ACCEPT, None), (QUEUE, None) or (DECLINE, reason for Lichess)
+        '''
+        challengeID = challenge['id']
+
+        with self.lock:
+            if challenge.get('speed') not in self.speeds:
+                self.declined += 1
+                return DECLINE, 'timeControl'
+
+            if not self.fits(challenge):
+                self.declined += 1
+                return DECLINE, 'tooSlow'
+
+            if len(self.live) < self.maxGames:
+                self.live.add(challengeID)
+                return ACCEPT, None
+
+            if len(self.queue) < self.queueSize:
+                self.queue[challengeID] = (duration(challenge), time.monotonic(), challenge)
+                return QUEUE, None
+
+            self.declined += 1
+            return DECLINE, 'later'
+
+
+    def started(self, gameID):
+        '''
+          Count a game as live (e.g. one of our challenges was accepted).
+        '''
+        with self.lock:
+            self.live.add(gameID)
+
+
+    def finish(self, gameID):
+        '''
+          A game ended (or could not start): free it.
+            Output:
+                 list of queued challenges to accept now, fastest first
+        '''
+        with self.lock:
+            self.live.discard(gameID)
+
+            admitted = []
+            for (seconds, arrival, challenge) in sorted(self.queue.values(), key = lambda c: c[:2]):
+                if len(self.live) >= self.maxGames:
+                    break
+                if self.fits(challenge):
+                    del self.queue[challenge['id']]
+                    self.live.add(challenge['id'])
+                    admitted.append(challenge)
+
+            return admitted
+
+
+    def cancel(self, challengeID):
+        '''
+          Forget a queued challenge (canceled by the challenger).
+        '''
+        with self.lock:
+            self.queue.pop(challengeID, None)
+
+
+    def expire(self, challengeID):
+        '''
+          Output:
+               Boolean (true) if the challenge was still queued, and it is
+               no longer (to be declined)
+        '''
+        with self.lock:
+            if self.queue.pop(challengeID, None) is None:
+                return False
+            self.declined += 1
+            return True
+
+
+    def stats(self):
+        with self.lock:
+            return { 'live' : len(self.live), 'queued' : len(self.queue), 'maxGames' : self.maxGames,
+                     'declined' : self.declined }
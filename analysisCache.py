@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+
+import json
+import math
+import sqlite3
+import threading
+import collections
+
+# Must install python-chess for the following:
+import chess
+import chess.polyglot
+
+import botMetrics
+
+def lines(info):
+    '''
+      Convert an engine analysis into a cacheable (JSON serializable) value.
+        Input:
+             info (list of info dictionaries, as returned by analyse with multipv)
+
+        Output:
+             list of dictionaries with keys 'pv' (list of UCI moves) and 'score'
+             (relative score in centipawns)
+    '''
+    return [{ 'pv' : [m.uci() for m in line.get('pv', [])],
+              'score' : line['score'].relative.score(mate_score = 10**6) } for line in info]
+
+
+def quantize(seconds, steps = 4):
+    '''
+      Round a search time to a fixed ladder ('steps' values per doubling, within
+      ~9% with the default), so that time-limited searches of a position can
+      share cache entries instead of each budget getting its own.
+        Input:
+             seconds (time budget of a search)
+
+        Output:
+             seconds (the nearest value of the ladder; budgets under 0.01 count as 0.01)
+    '''
+    seconds = max(seconds, 0.01)
+    return round(2 ** (round(steps * math.log2(seconds)) / steps), 4)
+
+
+class AnalysisCache(object):
+
+    def __init__(self, path = './analysis_cache.sqlite', maxEntries = 100000, maxDiskEntries = 1000000,
+                 pruneEvery = 1000):
+        '''
+          Two-tier cache of engine analyses: a bounded in-memory LRU in front of
+          an sqlite file, which survives restarts and can be shared by several
+          BOT processes.
+            Input:
+                          path (optional, sqlite file, or None for a memory-only cache)
+                    maxEntries (optional, number of analyses kept in memory)
+                maxDiskEntries (optional, number of analyses kept on disk; the oldest
+                                written are deleted beyond it)
+                    pruneEvery (optional, writes between two checks of the disk size)
+        '''
+
+        self.maxEntries = maxEntries
+        self.maxDiskEntries = maxDiskEntries
+        self.pruneEvery = pruneEvery
+        self.writes = 0
+        self.memory = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+        self.hits = 0
+        self.diskHits = 0
+        self.misses = 0
+
+        self.db = None
+        if path:
+            self.db = sqlite3.connect(path, check_same_thread = False, timeout = 10)
+            self.db.execute('PRAGMA journal_mode=WAL')
+            self.db.execute('CREATE TABLE IF NOT EXISTS analysis (key TEXT PRIMARY KEY, value TEXT)')
+            self.db.commit()
+
+
+    def key(self, board, limit, multiPV, engine):
+        '''
+          Build the cache key of an analysis.
+            Input:
+                 board (chess.Board type, from python-chess)
+                 limit (chess.engine.Limit type)
+               multiPV (int: number of lines)
+                engine (string: engine identity, e.g. EnginePool.name)
+
+            Output:
+                string (key)
+        '''
+        return '%016x|%r|%d|%s' % (chess.polyglot.zobrist_hash(board), limit, multiPV, engine)
+
+
+    def get(self, key):
+        '''
+          Look an analysis up, first in memory and then on disk.
+            Output:
+                the cached value, or None
+        '''
+        with self.lock:
+            value = self.memory.get(key)
+            if value is not None:
+                self.memory.move_to_end(key)
+                self.hits += 1
+                botMetrics.count('cacheHits')
+                return value
+
+            if self.db:
+                row = self.db.execute('SELECT value FROM analysis WHERE key = ?', (key,)).fetchone()
+                if row:
+                    value = json.loads(row[0])
+                    self.remember(key, value)
+                    self.hits += 1
+                    self.diskHits += 1
+                    botMetrics.count('cacheHits')
+                    botMetrics.count('cacheDiskHits')
+                    return value
+
+            self.misses += 1
+            botMetrics.count('cacheMisses')
+            return None
+
+
+    def put(self, key, value):
+        '''
+          Store an analysis (any JSON serializable value) in both tiers.
+        '''
+        with self.lock:
+            self.remember(key, value)
+            if self.db:
+                self.db.execute('INSERT OR REPLACE INTO analysis VALUES (?, ?)', (key, json.dumps(value)))
+                self.writes += 1
+                if self.writes % self.pruneEvery == 0:
+                    self.prune()
+                self.db.commit()
+
+
+    def prune(self):
+        '''
+          Delete the oldest analyses on disk beyond 'maxDiskEntries' (holding the lock).
+          Rows rewritten by 'put' get a new rowid, so rowid order is write order.
+        '''
+        (count,) = self.db.execute('SELECT COUNT(*) FROM analysis').fetchone()
+        if count > self.maxDiskEntries:
+            self.db.execute('DELETE FROM analysis WHERE rowid IN '
+                            '(SELECT rowid FROM analysis ORDER BY rowid LIMIT ?)',
+                            (count - self.maxDiskEntries,))
+
+
+    def remember(self, key, value):
+        '''
+          Insert in the in-memory LRU, evicting the least recently used entry.
+        '''
+        self.memory[key] = value
+        self.memory.move_to_end(key)
+        if len(self.memory) > self.maxEntries:
+            self.memory.popitem(last = False)
+
+
+    def stats(self):
+        '''
+          Output:
+                dictionary with the hit and miss counters
+        '''
+        total = self.hits + self.misses
+        return { 'hits' : self.hits, 'diskHits' : self.diskHits, 'misses' : self.misses,
+                 'hitRate' : self.hits / total if total else 0, 'size' : len(self.memory) }
+
+
+    def close(self):
+        '''
+          Close the on-disk store.
+        '''
+        if self.db:
+            self.db.close()
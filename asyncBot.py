@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+
+import asyncio
+import json
+import time
+import concurrent.futures
+
+import myBot
+import rateLimit
+
+# Must install aiohttp for the following:
+import aiohttp
+
+class AsyncBot(myBot.Bot):
+
+    def __init__(self, name, token, moveSelector, addTimeMessage,
+                 poolSize = 32, timeout = 10, workers = 8, api = 'https://lichess.org/api/',
+                 metrics = None, admissionControl = None, rateLimiter = None):
+        '''
+          Asynchronous BOT object creator.
+          The event stream and every game stream are coroutines on a single event
+          loop; the moveSelector (and the API calls it leads to) runs in a pool of
+          worker threads, so the same moveSelector functions keep working.
+            Input:
+                      name, token, moveSelector, addTimeMessage, poolSize, timeout, api, metrics,
+                           admissionControl, rateLimiter
+                           (as in myBot.Bot)
+                   workers (optional, number of threads running the moveSelectors)
+        '''
+
+        myBot.Bot.__init__(self, name, token, moveSelector, addTimeMessage,
+                           poolSize = poolSize, timeout = timeout, api = api, metrics = metrics,
+                           admissionControl = admissionControl, rateLimiter = rateLimiter)
+
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers = workers)
+        self.loop = None
+        self.http = None
+
+
+    async def lines(self, endpoint):
+        '''
+          Iterate over the (non-empty) lines of an ndjson stream.
+            Input:
+                endpoint (string: path relative to the API root)
+
+            Output:
+                async iterator of dictionaries (parsed lines)
+
+            Raises aiohttp.ClientResponseError if Lichess refuses the stream
+        '''
+        label = rateLimit.label(endpoint)
+        priority = rateLimit.priority(label)
+        waited = await self.loop.run_in_executor(self.executor, self.limiter.acquire, priority)
+
+        timeout = aiohttp.ClientTimeout(total = None, sock_connect = self.timeout)
+        async with self.http.get(self.api + endpoint, timeout = timeout) as ans:
+            self.limiter.record(label, priority, ans.status, ans.headers.get('Retry-After'), waited)
+
+            # An error body is not a stream: reconnect with backoff instead
+            ans.raise_for_status()
+
+            while True:
+                line = await ans.content.readline()
+                if not line:
+                    return
+
+                line = line.strip()
+                if line:
+                    print(line, flush = True)
+                    yield json.loads(line)
+
+
+    async def play_game_async(self, gameID, maxReconnects = 5):
+        '''
+          Play a game which has started, as a coroutine (its runner must be
+          registered, see 'start_game'), resuming it if the stream drops.
+            Input:
+                    gameID (game identifier)
+             maxReconnects (optional, reconnections in a row before giving up)
+        '''
+        game = self.new_game(gameID)
+        self.metrics.count('games')
+        attempt = 0
+        over = False
+
+        try:
+            while not self.closing.is_set():
+
+                try:
+                    async for info in self.lines('bot/game/stream/' + gameID):
+                        attempt = 0
+                        if self.metrics:
+                            game.received = time.perf_counter()
+                        alive = await self.loop.run_in_executor(self.executor, self.game_event, game, info)
+                        if not alive:
+                            over = True
+                            return
+
+                except Exception as e:
+                    print(e)
+
+                if attempt >= maxReconnects:
+                    return
+
+                self.metrics.count('gameReconnects')
+                await asyncio.sleep(myBot.backoff(attempt))
+                attempt += 1
+
+        finally:
+            game.close()
+            self.release(gameID, over)
+            await self.loop.run_in_executor(self.executor, self.game_over, gameID)
+
+
+    def start_game(self, gameID):
+        '''
+          Schedule a game on the event loop (can be called from any thread),
+          unless it is already being played.
+            Input:
+                    gameID (game identifier)
+        '''
+        def spawn():
+            if self.claim(gameID):
+                self.runners[gameID] = self.loop.create_task(self.play_game_async(gameID))
+
+        self.loop.call_soon_threadsafe(spawn)
+
+
+    def schedule_move(self, game, delay, args):
+        '''
+          Send a delayed move from the event loop (see myBot.Bot.schedule_move):
+          a loop timer runs 'send_delayed' in the worker threads when it is due.
+        '''
+        def later():
+            game.timer = self.loop.call_later(
+                delay, self.loop.run_in_executor, self.executor, self.send_delayed, *args)
+
+        self.loop.call_soon_threadsafe(later)
+
+
+    async def wait_for_challenges_async(self):
+        '''
+          Continuously wait for challenges, playing all the games on this loop.
+          Challenges sent meanwhile (e.g. with 'challenge_users' from another
+          thread) are answered from this same event stream.
+        '''
+        self.loop = asyncio.get_running_loop()
+        self.acceptChallenges = True
+
+        # This coroutine is the reader of the event stream (see myBot.Bot.listen)
+        with self.readerLock:
+            self.reader = asyncio.current_task()
+
+        async with aiohttp.ClientSession(headers = self.auth) as http:
+            self.http = http
+
+            attempt = 0
+
+            while not self.closing.is_set():
+                connectedAt = time.monotonic()
+                try:
+                    self.connected.set()
+                    async for info in self.lines('stream/event'):
+                        await self.loop.run_in_executor(self.executor, self.dispatch, info)
+
+                except Exception as e:
+                    print(e)
+
+                self.connected.clear()
+                if time.monotonic() - connectedAt > 60:
+                    attempt = 0
+
+                self.metrics.count('eventReconnects')
+                await asyncio.sleep(myBot.backoff(attempt))
+                attempt += 1
+
+
+    def wait_for_challenges(self):
+        '''
+          Continuously wait for challenges.
+          When a challenge comes, accept it, play the game and continue.
+        '''
+        asyncio.run(self.wait_for_challenges_async())
@@ -0,0 +1,364 @@
+#!/usr/bin/env python3
+
+'''
+  Offline benchmarks of the engine, book and BOT hot paths.
+
+  Usage:
+      python benchmark.py [--output results.json] [--compare old.json] [--quick]
+
+  Everything runs without network, Stockfish or the elite.bin book: the book is
+  a polyglot file generated from a fixed seed and Stockfish is replaced by a
+  deterministic stub, so two runs on the same machine are comparable.
+'''
+
+import io
+import os
+import sys
+import json
+import math
+import time
+import random
+import struct
+import argparse
+import platform
+import tempfile
+import contextlib
+import subprocess
+
+# Must install python-chess for the following:
+import chess
+import chess.engine
+import chess.polyglot
+
+import book
+import bookIndex
+import enginePool
+import analysisCache
+import compactBoard
+import myBot
+import simpleEngine
+
+SEED = 2020
+
+# Positions searched by the engine benchmarks
+FENS = [
+    chess.STARTING_FEN,
+    'rnbqkb1r/pppppppp/5n2/8/4P3/8/PPPP1PPP/RNBQKBNR w KQkq - 1 2',
+    'r1bqkbnr/pppp1ppp/2n5/4p3/2B1P3/5N2/PPPP1PPP/RNBQK2R b KQkq - 3 3',
+    'r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10',
+    'r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1',
+    '8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1',
+]
+
+
+class StubEngines(object):
+    '''
+      Stand-in for enginePool.EnginePool: answers instantly with a deterministic
+      analysis (legal moves in a seeded order, with seeded scores).
+    '''
+
+    name = 'stub'
+
+    def __init__(self, *args, **kwargs):
+        self.idle = None
+
+    def analyse(self, board, limit, multipv = None):
+        rand = random.Random(chess.polyglot.zobrist_hash(board) ^ SEED)
+        moves = sorted(board.legal_moves, key = lambda m: m.uci())
+        rand.shuffle(moves)
+        scores = sorted((rand.randint(-300, 300) for _ in moves), reverse = True)
+        info = [{ 'pv' : [m], 'score' : chess.engine.PovScore(chess.engine.Cp(s), board.turn) }
+                for (m, s) in zip(moves, scores)][:multipv or 1]
+        return info if multipv else info[0]
+
+    def close(self):
+        pass
+
+
+def generate_book(path, seed = SEED, depth = 6, width = 4):
+    '''
+      Write a polyglot book with the positions of a seeded random tree of openings.
+        Output:
+             list of boards in the book (to be probed)
+    '''
+    rand = random.Random(seed)
+    entries = []
+    boards = []
+
+    def walk(board, d):
+        boards.append(board.copy(stack = False))
+        if d == 0:
+            return
+
+        moves = sorted(board.legal_moves, key = lambda m: m.uci())
+        rand.shuffle(moves)
+        for m in moves[:width]:
+            raw = (m.from_square << 6) | m.to_square | ((m.promotion - 1) << 12 if m.promotion else 0)
+            entries.append((chess.polyglot.zobrist_hash(board), raw, rand.randint(1, 500), rand.getrandbits(32)))
+            board.push(m)
+            walk(board, d - 1)
+            board.pop()
+
+    walk(chess.Board(), depth)
+    entries.sort(key = lambda e: e[0])
+
+    with open(path, 'wb') as f:
+        for entry in entries:
+            f.write(struct.pack('>QHHI', *entry))
+
+    return boards
+
+
+def rate(count, seconds):
+    return count / seconds if seconds > 0 else float('inf')
+
+
+def timed(function, repeat):
+    '''
+      Run a function 'repeat' times.
+        Output:
+             seconds per call
+    '''
+    start = time.perf_counter()
+    for _ in range(repeat):
+        function()
+    return (time.perf_counter() - start) / repeat
+
+
+def percentiles(samples):
+    samples = sorted(samples)
+    pick = lambda q: samples[min(len(samples) - 1, int(q * len(samples)))]
+    return { 'mean' : sum(samples) / len(samples), 'p50' : pick(0.5), 'p95' : pick(0.95),
+             'max' : samples[-1], 'count' : len(samples) }
+
+
+def bench_perft(depth):
+    output = {}
+    for fen in compactBoard.PERFT_FENS:
+        position = compactBoard.Position(chess.Board(fen))
+        start = time.perf_counter()
+        nodes = compactBoard.perft(position, depth)
+        seconds = time.perf_counter() - start
+        output[fen] = { 'depth' : depth, 'nodes' : nodes, 'seconds' : seconds, 'nps' : rate(nodes, seconds) }
+    return output
+
+
+def bench_search(depth):
+    output = {}
+    for fen in FENS:
+        engine = simpleEngine.SimpleEngine()
+        start = time.perf_counter()
+        (value, best) = engine.analyse(chess.Board(fen), depth)
+        seconds = time.perf_counter() - start
+        output[fen] = { 'depth' : depth, 'nodes' : engine.nodes, 'cutoffs' : engine.cutoffs,
+                        'score' : value, 'best' : str(best), 'seconds' : seconds,
+                        'nps' : rate(engine.nodes, seconds) }
+    return output
+
+
+def bench_parallel(depth, workers = None):
+    '''
+      Speedup of ParallelEngine over SimpleEngine, both deepening iteratively
+      to the same depth (ParallelEngine uses one process per core by default).
+    '''
+    parallel = simpleEngine.ParallelEngine(workers)
+    output = { 'workers' : parallel.workers, 'depth' : depth }
+    speedups = []
+
+    try:
+        parallel.search(chess.Board(), float('inf'), float('inf'), maxDepth = 2)
+
+        for fen in FENS:
+            engine = simpleEngine.SimpleEngine()
+            start = time.perf_counter()
+            (_, best, _) = engine.search(chess.Board(fen), float('inf'), float('inf'), maxDepth = depth)
+            simpleSeconds = time.perf_counter() - start
+
+            start = time.perf_counter()
+            (_, parallelBest, _) = parallel.search(chess.Board(fen), float('inf'), float('inf'), maxDepth = depth)
+            parallelSeconds = time.perf_counter() - start
+
+            speedups.append(simpleSeconds / parallelSeconds)
+            output[fen] = { 'simpleSeconds' : simpleSeconds, 'simpleNodes' : engine.nodes,
+                            'parallelSeconds' : parallelSeconds, 'parallelNodes' : parallel.nodes,
+                            'speedup' : speedups[-1], 'sameMove' : best == parallelBest }
+    finally:
+        parallel.close()
+
+    # Geometric mean over the positions
+    output['speedup'] = 2 ** (sum(math.log2(s) for s in speedups) / len(speedups))
+    return output
+
+
+def bench_evaluation(repeat):
+    engine = simpleEngine.SimpleEngine(ttMegabytes = 0)
+    boards = [chess.Board(fen) for fen in FENS]
+    seconds = timed(lambda: [engine.absolute_evaluation(b) for b in boards], repeat)
+    return { 'evaluationsPerSecond' : rate(len(boards), seconds) }
+
+
+def bench_book(path, boards, repeat):
+    readers = { 'polyglot' : chess.polyglot.open_reader(path),
+                'compiled' : bookIndex.CompiledBook(path) }
+
+    rand = random.Random(SEED)
+    probes = rand.sample(boards, min(len(boards), 200))
+    moves = [rand.choice(list(b.legal_moves)).uci() for b in probes]
+
+    output = {}
+    for (name, reader) in readers.items():
+
+        def cold():
+            for b in probes:
+                book.BOOK_CACHE.clear()
+                book.bookMoves(reader, b)
+
+        def warm():
+            for b in probes:
+                book.bookMoves(reader, b)
+
+        def classify():
+            for (b, m) in zip(probes, moves):
+                book.classifyMove(reader, b, m)
+
+        def pick():
+            for b in probes:
+                book.randomBookMove(reader, b)
+
+        random.seed(SEED)
+        book.BOOK_CACHE.clear()
+        output[name] = { 'bookMovesColdPerSecond' : rate(len(probes), timed(cold, repeat)) }
+
+        warm()
+        output[name].update({
+            'bookMovesWarmPerSecond' : rate(len(probes), timed(warm, repeat)),
+            'classifyMovePerSecond'  : rate(len(probes), timed(classify, repeat)),
+            'randomBookMovePerSecond' : rate(len(probes), timed(pick, repeat)),
+        })
+
+    readers['polyglot'].close()
+    return output
+
+
+def bench_selectors(path, plies, games):
+    '''
+      Latency of the BOT moveSelectors along seeded random games, with Stockfish
+      stubbed, the generated book and a memory-only analysis cache.
+    '''
+
+    realPool, realBook, realCache = enginePool.EnginePool, bookIndex.CompiledBook, analysisCache.AnalysisCache
+    enginePool.EnginePool = StubEngines
+    bookIndex.CompiledBook = lambda *args, **kwargs: realBook(path)
+    analysisCache.AnalysisCache = lambda *args, **kwargs: realCache(None)
+
+    try:
+        import botam1k
+        import chamberi
+    finally:
+        enginePool.EnginePool, bookIndex.CompiledBook, analysisCache.AnalysisCache = realPool, realBook, realCache
+
+    output = {}
+    for (name, selector) in (('botam1k', botam1k.botam1k), ('chamberi', chamberi.weak_engine)):
+        rand = random.Random(SEED)
+        random.seed(SEED)
+        samples = []
+
+        for _ in range(games):
+            session = myBot.GameSession(None)
+            board = session.board
+            extra = [session] if getattr(selector, 'takesSession', False) else []
+            for _ in range(plies):
+                if board.is_game_over():
+                    break
+
+                # 60 seconds each: no artificial delays in chamberi
+                start = time.perf_counter()
+                with contextlib.redirect_stdout(io.StringIO()):
+                    (move, msg) = selector(board, 60, 60, *extra)
+                samples.append(time.perf_counter() - start)
+
+                if move == 'resign':
+                    break
+                board.push_uci(move)
+
+                reply = sorted(board.legal_moves, key = lambda m: m.uci())
+                if not reply:
+                    break
+                board.push(rand.choice(reply))
+
+        output[name] = percentiles(samples)
+
+    return output
+
+
+def run(quick = False):
+    '''
+      Run all the benchmarks.
+        Output:
+             dictionary with the results (JSON serializable)
+    '''
+    try:
+        commit = subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr = subprocess.DEVNULL,
+                                         cwd = os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except Exception:
+        commit = None
+
+    repeat = 1 if quick else 5
+    results = { 'commit' : commit, 'python' : platform.python_version(), 'seed' : SEED,
+                'quick' : quick, 'time' : time.time() }
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'bench.bin')
+        boards = generate_book(path, depth = 4 if quick else 6)
+
+        results['perft'] = bench_perft(2 if quick else 3)
+        results['search'] = bench_search(2 if quick else 3)
+        results['parallel'] = bench_parallel(3 if quick else 4)
+        results['evaluation'] = bench_evaluation(20 if quick else 200)
+        results['book'] = bench_book(path, boards, repeat)
+        results['selectors'] = bench_selectors(path, 20 if quick else 40, 2 if quick else 5)
+
+    return results
+
+
+def flatten(results, prefix = ''):
+    output = {}
+    for (key, value) in results.items():
+        if isinstance(value, dict):
+            output.update(flatten(value, prefix + key + '/'))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            output[prefix + key] = value
+    return output
+
+
+def compare(old, new):
+    '''
+      Print the ratio new / old of every rate and timing present in both results.
+    '''
+    old, new = flatten(old), flatten(new)
+    for key in sorted(set(old) & set(new)):
+        if key in ('time', 'seed') or not old[key]:
+            continue
+        print("%-100s %12.4g %12.4g  x%.2f" % (key, old[key], new[key], new[key] / old[key]))
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description = 'Benchmark the engine, book and BOT hot paths.')
+    parser.add_argument('--output', '-o', help = 'JSON file where the results are written')
+    parser.add_argument('--compare', '-c', help = 'JSON file of a previous run to compare with')
+    parser.add_argument('--quick', action = 'store_true', help = 'smaller (less precise) run')
+    args = parser.parse_args()
+
+    results = run(quick = args.quick)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent = 2)
+    else:
+        json.dump(results, sys.stdout, indent = 2)
+        print()
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), results)
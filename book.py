@@ -8,6 +8,12 @@ import chess
 import chess.polyglot
 import random
 import math
+import threading
+import weakref
+import collections
+import collections.abc
+
+import botMetrics
 
 def myround(n):
 
@@ -41,14 +47,12 @@ def round_percentages(percentages,ndecimals):
     return output
 
 
-def learnInfo(info, min_elo = 2200):
+def learnGames(info, min_elo = 2200):
 
     avg_ELO = min_elo + info.learn % 2**10
     defeats_127 = (info.learn >> 10) % 2**7
     victories_127 = (info.learn >> 17) % 2**7
-    draws_127 = max(0, 127 - victories_127 - defeats_127)
     scaleFactor = (info.learn >> 24) % 2**8
-    percentages = round_percentages([victories_127*100/127, draws_127*100/127, defeats_127*100/127], 2)
 
     if (info.weight > 0):
         halfpoints = info.weight * scaleFactor
@@ -60,39 +64,220 @@ def learnInfo(info, min_elo = 2200):
     else:
         ngames = scaleFactor
 
+    return ngames, avg_ELO
+
+
+def learnPercentages(learn):
+
+    defeats_127 = (learn >> 10) % 2**7
+    victories_127 = (learn >> 17) % 2**7
+    draws_127 = max(0, 127 - victories_127 - defeats_127)
+    return round_percentages([victories_127*100/127, draws_127*100/127, defeats_127*100/127], 2)
+
+
+def learnInfo(info, min_elo = 2200):
+
+    ngames, avg_ELO = learnGames(info, min_elo)
+    percentages = learnPercentages(info.learn)
     return info.move, ngames, ','.join([str(p) for p in percentages]), avg_ELO
 
 
+class BookMove(collections.abc.Mapping):
+    '''
+      A book move of a position: a read-only mapping with the keys
+        'UCI', 'SAN', 'numGames', 'results', 'avgELO'
+      computing the SAN and the results only when asked for.
+    '''
+
+    __slots__ = ('position', 'i')
+
+    FIELDS = ('UCI', 'SAN', 'numGames', 'results', 'avgELO')
+
+    def __init__(self, position, i):
+        self.position = position
+        self.i = i
+
+    def __getitem__(self, field):
+        position, i = self.position, self.i
+        if field == 'UCI':       return str(position.moves[i])
+        if field == 'numGames':  return position.games[i]
+        if field == 'avgELO':    return position.elos[i]
+        if field == 'SAN':       return position.san(i)
+        if field == 'results':   return position.results(i)
+        raise KeyError(field)
+
+    def __iter__(self):
+        return iter(self.FIELDS)
+
+    def __len__(self):
+        return len(self.FIELDS)
+
+    def __repr__(self):
+        return repr(dict(self))
+
+
+class BookPosition(object):
+    '''
+      The book moves of a position, behaving like a dictionary from UCI moves to
+      BookMove objects, in book order. N is the total number of games.
+    '''
+
+    __slots__ = ('board', 'moves', 'ucis', 'games', 'elos', 'learns', 'percentages', 'sans', 'N',
+                 'sortedMoves', 'ranks')
+
+    def __init__(self, board):
+        self.board = board.copy(stack = False)
+        self.moves = []
+        self.ucis = {}
+        self.games = []
+        self.elos = []
+        self.learns = []
+        self.percentages = []
+        self.sans = []
+        self.N = 0
+        self.sortedMoves = None
+        self.ranks = None
+
+    def add(self, move, ngames, avgELO, learn = None, percentages = None):
+        uci = self.board.uci(move)
+        self.N += ngames
+        values = (move, ngames, avgELO, learn, percentages, None)
+        lists = (self.moves, self.games, self.elos, self.learns, self.percentages, self.sans)
+
+        # A repeated move replaces the previous entry, as in a dictionary
+        i = self.ucis.get(uci)
+        if i is None:
+            self.ucis[uci] = len(self.moves)
+            for (l, v) in zip(lists, values):
+                l.append(v)
+        else:
+            for (l, v) in zip(lists, values):
+                l[i] = v
+
+    def ranking(self):
+        '''
+          Output:
+               list of (uci, BookMove), most played first, and the dictionary of
+               rankings (1 for the most played), computed once per position
+        '''
+        if self.sortedMoves is None:
+            moves = [(self.games[i], uci, i) for (uci, i) in self.ucis.items()]
+            moves.sort(reverse = True)
+            self.ranks = { uci : r + 1 for (r, (n, uci, i)) in enumerate(moves) }
+            self.sortedMoves = [(uci, BookMove(self, i)) for (n, uci, i) in moves]
+        return self.sortedMoves, self.ranks
+
+    def san(self, i):
+        if self.sans[i] is None:
+            self.sans[i] = self.board.san(self.moves[i])
+        return self.sans[i]
+
+    def results(self, i):
+        if self.percentages[i] is None:
+            self.percentages[i] = learnPercentages(self.learns[i])
+        (white, draw, black) = self.percentages[i]
+        return { 'white' : float(white), 'draw' : float(draw), 'black' : float(black) }
+
+    def __len__(self):
+        return len(self.ucis)
+
+    def __iter__(self):
+        return iter(self.ucis)
+
+    def __contains__(self, uci):
+        return uci in self.ucis
+
+    def keys(self):
+        return self.ucis.keys()
+
+    def get(self, uci, default = None):
+        i = self.ucis.get(uci)
+        return default if i is None else BookMove(self, i)
+
+    def __getitem__(self, uci):
+        return BookMove(self, self.ucis[uci])
+
+    def values(self):
+        return [BookMove(self, i) for i in self.ucis.values()]
+
+    def items(self):
+        return [(uci, BookMove(self, i)) for (uci, i) in self.ucis.items()]
+
+
+# Positions already looked up, by book and Zobrist hash (least recently used first)
+BOOK_CACHE = collections.OrderedDict()
+BOOK_CACHE_SIZE = 4096
+BOOK_CACHE_LOCK = threading.Lock()
+
+# Books with positions in BOOK_CACHE: their entries are dropped when they are
+# garbage collected, so that a new book reusing the id() does not find them
+BOOK_IDS = set()
+
+
+def bookID(book):
+    '''
+      Identity of a book in BOOK_CACHE (call holding BOOK_CACHE_LOCK).
+    '''
+    i = id(book)
+    if i not in BOOK_IDS:
+        BOOK_IDS.add(i)
+        weakref.finalize(book, forgetBook, i)
+    return i
+
+
+def forgetBook(i):
+    with BOOK_CACHE_LOCK:
+        BOOK_IDS.discard(i)
+        for key in [key for key in BOOK_CACHE if key[0] == i]:
+            del BOOK_CACHE[key]
+
+
 def bookMoves(book, board):
 
-    moves = {}
-    N = 0
-    for entry in book.find_all(board):
-        m, ngames, percentages, avgELO = learnInfo(entry)
-        N += ngames
-        (white, draw, black) = percentages.split(',')
-        moves[board.uci(m)] = {
-            'UCI' : str(m),
-            'SAN' : board.san(m),
-            'numGames' : ngames,
-            'results' : { 'white' : float(white), 'draw' : float(draw), 'black' : float(black) },
-            'avgELO' : avgELO
-        }
-    return moves, N
+    with botMetrics.span('book'):
+        return lookupBookMoves(book, board)
+
+
+def lookupBookMoves(book, board):
+
+    zobrist = chess.polyglot.zobrist_hash(board)
+    with BOOK_CACHE_LOCK:
+        key = (bookID(book), zobrist)
+        position = BOOK_CACHE.get(key)
+        if position is not None:
+            BOOK_CACHE.move_to_end(key)
+            return position
+
+    position = BookPosition(board)
+
+    # Compiled books (see bookIndex) come already decoded
+    if hasattr(book, 'decode'):
+        for (m, ngames, percentages, avgELO) in book.decode(board, key = key[1]):
+            position.add(m, ngames, avgELO, percentages = percentages)
+    else:
+        for entry in book.find_all(board):
+            ngames, avgELO = learnGames(entry)
+            position.add(entry.move, ngames, avgELO, learn = entry.learn)
+
+    with BOOK_CACHE_LOCK:
+        BOOK_CACHE[key] = position
+        if len(BOOK_CACHE) > BOOK_CACHE_SIZE:
+            BOOK_CACHE.popitem(last = False)
+
+    return position
 
 
 def randomBookMove(book, board):
 
-    moves, N = bookMoves(book, board)
+    position = bookMoves(book, board)
+    N = position.N
 
     if N == 0:
         return None
 
-    frequencies = [v['numGames'] for v in moves.values()]
-
     return random.choices(
-        population = [k for k in moves.keys()],
-        weights = [f/N for f in frequencies],
+        population = list(position.keys()),
+        weights = [f/N for f in position.games],
         k=1
     )[0]
 
@@ -110,25 +295,22 @@ def is_good(N,n,r):
 
 def findBookMoves(book, board):
 
-    bookmoves, N = bookMoves(book, board)
-    moves = [(d['numGames'],k, d) for (k,d) in bookmoves.items()]
-    moves.sort(reverse = True)
-    moves = [(m,d) for (n,m,d) in moves]
+    bookmoves = bookMoves(book, board)
+    moves, ranks = bookmoves.ranking()
 
-    return (bookmoves, N, moves)
+    return (bookmoves, bookmoves.N, moves)
 
 
 def top(bookmoves, N, moves, k = None):
 
-    ms = [m for (m,d) in moves]
     top = []
-    for m in moves[:k]:
+    for (i, m) in enumerate(moves[:k]):
         mInfo = bookmoves.get(m[0])
         if mInfo:
             n = mInfo.get('numGames')
-            r = ms.index(m[0]) + 1
+            r = i + 1
             if is_good(N,n,r):
-                top.append(m)
+                top.append((m[0], dict(mInfo)))
 
     return top
 
@@ -155,7 +337,7 @@ def classifyMove(book, board, move):
 
     if moveInfo:
         n = moveInfo.get('numGames')
-        r = [m[0] for m in moves].index(move) + 1
+        r = bookmoves.ranking()[1][move]
         output['num_games'] = n
         output['ranking'] = r
         output['is_good'] = is_good(N,n,r)
@@ -168,3 +350,29 @@ def classifyMove(book, board, move):
     output['top5'] = top(bookmoves, N, moves, k = 5)
 
     return output
+
+
+'''
+ Classify all the moves of a game (list of moves in uci notation), walking it
+ once on a single board. Return a list with the output of classifyMove for
+ every move (None if the position before it is not in the book), as plain
+ data (JSON serializable). Once the game leaves the book the remaining
+ positions are not looked up: they are all None.
+'''
+
+def classify_game(book, moves):
+
+    if isinstance(moves, str):
+        moves = moves.split()
+
+    board = chess.Board()
+    output = []
+
+    for move in moves:
+        info = classifyMove(book, board, move)
+        if info is None:
+            break
+        output.append(info)
+        board.push_uci(move)
+
+    return output + [None] * (len(moves) - len(output))
@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+
+import os
+
+# Must install python-chess and numpy for the following:
+import chess
+import chess.polyglot
+import numpy as np
+
+# Polyglot entries, as stored on disk (16 bytes, big endian)
+RAW = np.dtype([('key', '>u8'), ('move', '>u2'), ('weight', '>u2'), ('learn', '>u4')])
+
+# Compiled entries, with the move and the learn information already decoded
+# (see book.learnInfo); castling is still encoded as the king taking the rook
+ENTRY = np.dtype([('key', '<u8'), ('move', '<u2'), ('weight', '<u2'), ('games', '<i8'),
+                  ('white', '<f8'), ('draw', '<f8'), ('black', '<f8'), ('elo', '<i4'),
+                  ('from', 'u1'), ('to', 'u1'), ('promotion', 'u1')])
+
+
+def round_percentages(percentages, ndecimals):
+    '''
+      Vectorized version of book.round_percentages, applied to every row.
+        Input:
+            percentages (numpy array of shape (N, k))
+              ndecimals (int: number of decimals to keep)
+
+        Output:
+            numpy array of shape (N, k)
+    '''
+    scale = 10**ndecimals
+    positive = percentages > 0
+    floors = np.where(positive, np.floor(scale * percentages), 0)
+    decimals = percentages - floors
+    missing = 100 * scale - floors.sum(axis = 1)
+
+    # Rank of each column when sorting the (decimal, column) pairs of the row in
+    # reverse order, only among the positive percentages
+    k = percentages.shape[1]
+    columns = np.arange(k)
+    ahead = (decimals[:, None, :] > decimals[:, :, None]) | \
+            ((decimals[:, None, :] == decimals[:, :, None]) & (columns[None, :] > columns[:, None]))
+    rank = (ahead & positive[:, None, :]).sum(axis = 2)
+
+    floors += positive & (rank < missing[:, None])
+    return floors / scale
+
+
+def decode(raw, min_elo = 2200):
+    '''
+      Decode the learn information of polyglot entries in one vectorized pass.
+        Input:
+                raw (numpy array of dtype RAW)
+            min_elo (optional, minimum ELO of the book)
+
+        Output:
+            numpy array of dtype ENTRY
+    '''
+    learn = raw['learn'].astype(np.int64)
+    weight = raw['weight'].astype(np.int64)
+
+    defeats_127 = (learn >> 10) % 2**7
+    victories_127 = (learn >> 17) % 2**7
+    draws_127 = np.maximum(0, 127 - victories_127 - defeats_127)
+    scaleFactor = (learn >> 24) % 2**8
+
+    percentages = np.stack([victories_127 * 100 / 127, draws_127 * 100 / 127,
+                            defeats_127 * 100 / 127], axis = 1)
+    percentages = round_percentages(percentages, 2)
+
+    # np.where evaluates both branches: the division by zero (all defeats)
+    # is computed but not used
+    halfpoints = weight * scaleFactor
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        ngames = np.where(victories_127 - defeats_127 > 0,
+                          np.round(halfpoints / (1 + victories_127 / 127 - defeats_127 / 127)),
+                          2 * halfpoints)
+    ngames = np.where(weight > 0, ngames, scaleFactor)
+
+    entries = np.empty(len(raw), dtype = ENTRY)
+    entries['key'] = raw['key']
+    entries['move'] = raw['move']
+    entries['weight'] = raw['weight']
+    entries['games'] = ngames
+    entries['white'], entries['draw'], entries['black'] = percentages.T
+    entries['elo'] = min_elo + learn % 2**10
+
+    move = raw['move'].astype(np.int64)
+    promotion = (move >> 12) & 0x7
+    entries['from'] = (move >> 6) & 0x3f
+    entries['to'] = move & 0x3f
+    entries['promotion'] = np.where(promotion > 0, promotion + 1, 0)
+    return entries
+
+
+def compile_book(path, output = None):
+    '''
+      Compile a polyglot book into a sorted array of decoded entries.
+        Input:
+              path (string: polyglot (.bin) file)
+            output (optional, string: .npy file where the compiled book is saved)
+
+        Output:
+            numpy array of dtype ENTRY
+    '''
+    entries = decode(np.fromfile(path, dtype = RAW))
+    entries = entries[np.argsort(entries['key'], kind = 'stable')]
+
+    if output:
+        np.save(output, entries)
+
+    return entries
+
+
+class CompiledBook(object):
+
+    def __init__(self, path, cache = None):
+        '''
+          Opening book backed by a compiled array, with binary search lookups.
+            Input:
+                  path (string: polyglot (.bin) file or compiled (.npy) file)
+                 cache (optional, string: .npy file where the compiled book is kept,
+                        recompiled only if older than the polyglot file)
+        '''
+
+        if path.endswith('.npy'):
+            self.entries = np.load(path, mmap_mode = 'r')
+            if self.entries.dtype != ENTRY:
+                raise ValueError('%s was compiled by an older version, compile it again' % path)
+
+        else:
+            self.entries = None
+            if cache and os.path.exists(cache) and os.path.getmtime(cache) >= os.path.getmtime(path):
+                self.entries = np.load(cache, mmap_mode = 'r')
+
+            # Caches written by an older version are compiled again
+            if self.entries is None or self.entries.dtype != ENTRY:
+                self.entries = compile_book(path, cache)
+
+        self.keys = self.entries['key']
+
+
+    def __len__(self):
+        return len(self.entries)
+
+
+    def lookup(self, board, key = None):
+        '''
+          All the compiled entries of a position.
+            Input:
+                 board (chess.Board type, from python-chess)
+                   key (optional, its Zobrist hash, if already computed)
+
+            Output:
+                 numpy array of dtype ENTRY
+        '''
+        if key is None:
+            key = chess.polyglot.zobrist_hash(board)
+
+        # One binary search for both ends: the entries of the next key start
+        # where those of this one end
+        if key < 2**64 - 1:
+            (i, j) = np.searchsorted(self.keys, np.array([key, key + 1], dtype = np.uint64))
+        else:
+            (i, j) = (np.searchsorted(self.keys, np.uint64(key)), len(self.keys))
+        return self.entries[i:j]
+
+
+    def decode(self, board, minimum_weight = 1, key = None):
+        '''
+          The book moves of a position, with their decoded information, filtered
+          like chess.polyglot.MemoryMappedReader.find_all. The entries of the
+          position are decoded together from the compiled arrays; only the
+          legality of each candidate is checked one by one (there are few of
+          them, and that is cheaper than generating all the legal moves).
+            Input:
+                 board (chess.Board type, from python-chess)
+                   key (optional, its Zobrist hash, if already computed)
+
+            Output:
+                 list of (move, ngames, (white, draw, black), avgELO)
+        '''
+        entries = self.lookup(board, key)
+        if not len(entries):
+            return []
+
+        entries = entries[entries['weight'] >= minimum_weight]
+        fromSquares = entries['from'].astype(np.int64)
+        toSquares = entries['to'].astype(np.int64)
+
+        # Polyglot castling is the king taking its rook (e1h1), as in Chess960
+        if not board.chess960:
+            king = board.king(board.turn)
+            castling = (fromSquares == king) & (king % 8 == 4) & \
+                       ((toSquares - fromSquares == 3) | (toSquares - fromSquares == -4))
+            toSquares = np.where(castling, np.where(toSquares > fromSquares, king + 2, king - 2), toSquares)
+
+        output = []
+        for (a, b, p, ngames, white, draw, black, elo) in zip(
+                fromSquares.tolist(), toSquares.tolist(), entries['promotion'].tolist(),
+                entries['games'].tolist(), entries['white'].tolist(), entries['draw'].tolist(),
+                entries['black'].tolist(), entries['elo'].tolist()):
+
+            move = chess.Move(a, b, p or None)
+            if board.is_legal(move):
+                output.append((move, ngames, (white, draw, black), elo))
+
+        return output
@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+
+'''
+  Timing spans and counters of a BOT, aggregated into histograms and exposed
+  through a local HTTP endpoint or a periodic dump.
+
+  A Bot created with 'metrics = botMetrics.Metrics(name)' times every stage
+  of its moves; the library code (book, engine pool, analysis cache) reports
+  to the Metrics of the game being played in the current thread through the
+  module functions 'span' and 'count', which cost a thread-local lookup when
+  the BOT has no Metrics.
+'''
+
+import os
+import json
+import time
+import bisect
+import threading
+import contextlib
+import collections
+import http.server
+
+# Upper bounds of the histogram buckets, in seconds (the last one is open)
+BUCKETS = [m * 10**e for e in range(-4, 2) for m in (1, 2, 5)]
+
+
+class Histogram(object):
+    '''
+      Durations grouped in the fixed BUCKETS, plus their count, sum and maximum.
+    '''
+
+    __slots__ = ('counts', 'count', 'total', 'max')
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds):
+        self.counts[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def quantile(self, q):
+        '''
+          Output:
+               upper bound (seconds) of the bucket of the q-quantile
+        '''
+        rank = q * self.count
+        seen = 0
+        for (i, n) in enumerate(self.counts):
+            seen += n
+            if seen >= rank and n:
+                return min(BUCKETS[i], self.max) if i < len(BUCKETS) else self.max
+        return self.max
+
+    def summary(self):
+        ms = lambda s: round(1000 * s, 3)
+        return { 'count' : self.count, 'totalMS' : ms(self.total),
+                 'meanMS' : ms(self.total / self.count) if self.count else 0, 'maxMS' : ms(self.max),
+                 'p50MS' : ms(self.quantile(0.5)), 'p90MS' : ms(self.quantile(0.9)),
+                 'p99MS' : ms(self.quantile(0.99)),
+                 'buckets' : [[ms(b), n] for (b, n) in zip(BUCKETS + [float('inf')], self.counts) if n] }
+
+
+class Span(object):
+    '''
+      Context manager adding its duration to a histogram of a Metrics.
+    '''
+
+    __slots__ = ('metrics', 'name', 'start')
+
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.metrics.observe(self.name, time.perf_counter() - self.start)
+
+
+class Metrics(object):
+
+    def __init__(self, name = None):
+        '''
+          Metrics creator.
+            Input:
+                 name (optional, string: e.g. the BOT name, included in the snapshots)
+        '''
+        self.name = name
+        self.started = time.time()
+        self.counters = collections.Counter()
+        self.histograms = collections.defaultdict(Histogram)
+        self.lock = threading.Lock()
+        self.server = None
+        self.dumping = None
+
+    def __bool__(self):
+        return True
+
+    def count(self, name, n = 1):
+        with self.lock:
+            self.counters[name] += n
+
+    def observe(self, name, seconds):
+        with self.lock:
+            self.histograms[name].add(seconds)
+
+    def span(self, name):
+        '''
+          Time a block: with metrics.span('selector'): ...
+        '''
+        return Span(self, name)
+
+    def snapshot(self):
+        '''
+          Output:
+               dictionary (JSON serializable) with the counters and a summary of
+               every histogram, durations in milliseconds
+        '''
+        with self.lock:
+            return { 'name' : self.name, 'time' : time.time(), 'uptime' : time.time() - self.started,
+                     'counters' : dict(self.counters),
+                     'spans' : { name : h.summary() for (name, h) in sorted(self.histograms.items()) } }
+
+
+    def serve(self, port = 0, host = '127.0.0.1'):
+        '''
+          Answer every GET request with the JSON snapshot, in a background thread.
+            Input:
+                 port (optional, 0 picks a free port)
+                 host (optional, address to listen at)
+
+            Output:
+                 URL of the endpoint
+        '''
+        metrics = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                data = json.dumps(metrics.snapshot(), indent = 2).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+        self.server = http.server.ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target = self.server.serve_forever, daemon = True).start()
+        return 'http://%s:%d/' % self.server.server_address[:2]
+
+
+    def dump_every(self, seconds, path = None):
+        '''
+          Write the JSON snapshot every 'seconds', in a background thread.
+            Input:
+                 seconds (period of the dumps)
+                    path (optional, file replaced at every dump; stdout by default)
+        '''
+        self.dumping = threading.Event()
+
+        def dump(stop):
+            while not stop.wait(seconds):
+                self.dump(path)
+
+        threading.Thread(target = dump, args = [self.dumping], daemon = True).start()
+
+
+    def dump(self, path = None):
+        data = json.dumps(self.snapshot(), indent = 2)
+        if path:
+            with open(path + '.tmp', 'w') as f:
+                f.write(data)
+            os.replace(path + '.tmp', path)
+        else:
+            print(data, flush = True)
+
+
+    def close(self):
+        '''
+          Stop the endpoint and the periodic dumps.
+        '''
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+        if self.dumping:
+            self.dumping.set()
+            self.dumping = None
+
+
+class NullMetrics(object):
+    '''
+      Metrics that record nothing, used when a BOT has no Metrics.
+    '''
+
+    NULL_SPAN = contextlib.nullcontext()
+
+    def __bool__(self):
+        return False
+
+    def count(self, name, n = 1):
+        pass
+
+    def observe(self, name, seconds):
+        pass
+
+    def span(self, name):
+        return self.NULL_SPAN
+
+    def snapshot(self):
+        return {}
+
+    def close(self):
+        pass
+
+
+DISABLED = NullMetrics()
+
+# Metrics of the game played in the current thread
+CURRENT = threading.local()
+
+
+def activate(metrics):
+    '''
+      Make library code running in this thread report to 'metrics'.
+    '''
+    CURRENT.metrics = metrics
+
+
+def span(name):
+    return getattr(CURRENT, 'metrics', DISABLED).span(name)
+
+
+def count(name, n = 1):
+    getattr(CURRENT, 'metrics', DISABLED).count(name, n)
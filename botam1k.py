@@ -4,51 +4,67 @@ import random
 import sys
 
 import myBot
+import enginePool
+import analysisCache
 import book
+import bookIndex
 
 # Must install python-chess for the following:
 import chess
 import chess.engine
 import chess.polyglot
 
-STOCKFISH = chess.engine.SimpleEngine.popen_uci('./Stockfish/src/stockfish')
-BOOK = chess.polyglot.open_reader("/usr/share/scid/books/elite.bin")
+STOCKFISH = enginePool.EnginePool('./Stockfish/src/stockfish')
+PONDERER = enginePool.Ponderer(STOCKFISH)
+PONDER = False  # Set to True to analyse on the opponent's clock
+CACHE = analysisCache.AnalysisCache('./analysis_cache.sqlite')
+BOOK = bookIndex.CompiledBook("/usr/share/scid/books/elite.bin", cache = "./elite.npy")
 
-CHOSEN_IDX = []
-SUDDEN = False
-SUDDEN2 = False
-
-def stockfish(board, seconds = 1, Depth = None, outputInfo = False, multiPV = 1):
+def stockfish(board, seconds = 1, Depth = None, outputInfo = False, multiPV = 1, ponder = False):
     '''
       Pick a move using Stockfish at a low depth
         Input:
              board (chess.Board type, from python-chess)
+            ponder (optional, use the search done on the opponent's clock if we
+                    guessed their move)
 
         Output:
              move (chess.Move.from_uci type, from python-chess)
     '''
 
-    global STOCKFISH
     if not Depth:
+        # Quantized, so that the analysis can be found in the cache again
+        seconds = analysisCache.quantize(seconds)
         limit = chess.engine.Limit(time = seconds)
 
     else:
         limit = chess.engine.Limit(depth = Depth)
 
-    info = STOCKFISH.analyse(board, limit, multipv = multiPV)
-    output = []
+    key = CACHE.key(board, limit, multiPV, STOCKFISH.name)
+    info = CACHE.get(key)
+
+    # Collect the ponder search anyway, so that its engine is released
+    # (with a depth limit only a search at least that deep is used)
+    ponderInfo = PONDERER.hit(board, 0 if info else seconds, None if info else Depth) if ponder else None
 
-    for info_move in info:
+    if info is None:
+        if ponderInfo:
+            info = analysisCache.lines(ponderInfo[:multiPV])
 
-        try:
-            best = info_move['pv'][0]
-        except:
-            best = None
+        else:
+            info = analysisCache.lines(STOCKFISH.analyse(board, limit, multipv = multiPV))
+            CACHE.put(key, info)
+
+    output = []
 
-        score = info_move['score'].relative.score(mate_score = 10**6)
+    for line in info:
+
+        pv = [chess.Move.from_uci(m) for m in line['pv']]
+        best = pv[0] if pv else None
+        score = line['score']
 
         if outputInfo:
-            output.append({ 'move' : best, 'score' : score })
+            output.append({ 'move' : best, 'score' : score, 'pv' : pv })
 
         else:
             output.append(best)
@@ -59,28 +75,21 @@ def stockfish(board, seconds = 1, Depth = None, outputInfo = False, multiPV = 1)
         return output[0]
 
 
-def botam1k(moves, clockSeconds, oppSeconds):
+@myBot.session_selector
+def botam1k(b, clockSeconds, oppSeconds, session):
     '''
       Weak engine that picks a move
         Input:
-             board (chess.Board type, from python-chess)
+               board (chess.Board type, from python-chess, live board of the game)
+             session (myBot.GameSession type, keeping the state of this game)
 
         Output:
              move (chess.Move.from_uci type, from python-chess)
     '''
 
-    global CHOSEN_IDX
-    global SUDDEN
-    global SUDDEN2
-    if len(moves) < 2:
-        CHOSEN_IDX = []
-        SUDDEN = False
-        SUDDEN2 = False
-
-    # Set the board
-    b = chess.Board()
-    for move in moves:
-        b.push_uci(move)
+    # Blunder messages already sent, and the time trouble ones
+    state = session.state
+    chosenIdx = state.setdefault('chosenIdx', [])
 
     messages = {
          1 : "Hello, the name's ANIC, BOT AM1K!",
@@ -103,12 +112,12 @@ def botam1k(moves, clockSeconds, oppSeconds):
     if clockSeconds > 30:
 
         # Calculate the best moves
-        moves = stockfish(b, seconds = seconds, outputInfo = True, multiPV = PV)
+        moves = stockfish(b, seconds = seconds, outputInfo = True, multiPV = PV, ponder = PONDER)
         inTheDirt = [m for m in moves if m['score'] > 200]
 
     else:
 
-        moves = stockfish(b, Depth = 10, outputInfo = True)
+        moves = stockfish(b, Depth = 10, outputInfo = True, ponder = PONDER)
         moves = [moves]
         inTheDirt = [moves[0]]
 
@@ -132,21 +141,26 @@ def botam1k(moves, clockSeconds, oppSeconds):
             msg7 = "I love bludners! %s is magical!" % (bad)
 
             idx = random.randint(1,7)
-            if not idx in CHOSEN_IDX:
+            if not idx in chosenIdx:
                 msg = [msg1, msg2, msg3, msg4, msg5, msg6, msg7][idx-1]
 
-            CHOSEN_IDX.append(idx)
+            chosenIdx.append(idx)
 
     b.push(answer['move'])
     if b.is_checkmate():
         msg = "I am the best! 😎" # Sunglasses
+    b.pop()
 
-    if clockSeconds < 30 and not SUDDEN:
-        SUDDEN = True
+    # Think about the expected reply while the opponent does
+    if PONDER and len(answer['pv']) > 1:
+        PONDERER.start(b, answer['move'], answer['pv'][1], multipv = PV)
+
+    if clockSeconds < 30 and not state.get('sudden'):
+        state['sudden'] = True
         msg = "I waz playing with you like a cat with the food"
 
-    if clockSeconds < 30 and SUDDEN and not SUDDEN2:
-        SUDDEN2 = True
+    if clockSeconds < 30 and state.get('sudden') and not state.get('sudden2'):
+        state['sudden2'] = True
         msg = "No more jokes!!!"
 
     return str(answer['move']), msg
@@ -167,5 +181,4 @@ if __name__ == '__main__':
     except:
         Botam1k.wait_for_challenges()
 
-
-STOCKFISH.close()
+    STOCKFISH.close()
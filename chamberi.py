@@ -2,19 +2,22 @@
 
 import random
 import sys
-import time
 from subprocess import Popen, PIPE, STDOUT
 
 import myBot
+import enginePool
+import analysisCache
 import book
+import bookIndex
 
 # Must install python-chess for the following:
 import chess
 import chess.engine
 import chess.polyglot
 
-STOCKFISH = chess.engine.SimpleEngine.popen_uci('./Stockfish/src/stockfish')
-BOOK = chess.polyglot.open_reader("/usr/share/scid/books/elite.bin")
+STOCKFISH = enginePool.EnginePool('./Stockfish/src/stockfish')
+CACHE = analysisCache.AnalysisCache('./analysis_cache.sqlite')
+BOOK = bookIndex.CompiledBook("/usr/share/scid/books/elite.bin", cache = "./elite.npy")
 
 
 def stockfish(board, searchDepth = 10, outputInfo = False, multiPV = 1):
@@ -27,20 +30,23 @@ def stockfish(board, searchDepth = 10, outputInfo = False, multiPV = 1):
              move (chess.Move.from_uci type, from python-chess)
     '''
 
-    global STOCKFISH
     limit = chess.engine.Limit(depth = searchDepth)
 
-    info = STOCKFISH.analyse(board, limit, multipv = multiPV)
-    output = []
+    # Look the analysis up in the cache, shared with the other BOTs
+    key = CACHE.key(board, limit, multiPV, STOCKFISH.name)
+    info = CACHE.get(key)
+
+    if info is None:
+        info = analysisCache.lines(STOCKFISH.analyse(board, limit, multipv = multiPV))
+        CACHE.put(key, info)
 
-    for info_move in info:
+    output = []
 
-        try:
-            best = info_move['pv'][0]
-        except:
-            best = None
+    for line in info:
 
-        score = info_move['score'].relative.score(mate_score = 10**6)
+        pv = [chess.Move.from_uci(m) for m in line['pv']]
+        best = pv[0] if pv else None
+        score = line['score']
 
         if outputInfo:
             output.append({ 'move' : best, 'score' : score })
@@ -70,21 +76,17 @@ def pp_move(board, uci_move):
     return san
 
 
-def weak_engine(moves, clockSeconds, oppSeconds):
+@myBot.board_selector
+def weak_engine(b, clockSeconds, oppSeconds):
     '''
       Weak engine that picks a move.
         Input:
-             board (chess.Board type, from python-chess)
+             board (chess.Board type, from python-chess, live board of the game)
 
         Output:
              move (chess.Move.from_uci type, from python-chess)
     '''
 
-    # Set the board
-    b = chess.Board()
-    for move in moves:
-        b.push_uci(move)
-
     messages = {
          1 : "Hola, soy uno de los Robots de la Academia de Ajedrez Chamberi. 🤖", # Robot
          3 : "¡Buena partida! 🍀", # Clubs
@@ -97,8 +99,8 @@ def weak_engine(moves, clockSeconds, oppSeconds):
     msg = messages.get(b.fullmove_number, None)
 
     # Classify the move by the opponent according to the book
-    if len(moves) > 0:
-        b.pop()
+    if b.move_stack:
+        move = b.pop().uci()
         prefix = str(b.fullmove_number) + ("." if b.turn else "...")
         move_info = book.classifyMove(BOOK, b, move)
 
@@ -114,14 +116,14 @@ def weak_engine(moves, clockSeconds, oppSeconds):
     # Calculate the best moves
     moves = stockfish(b, searchDepth = 6, outputInfo = True, multiPV = 8)
 
-    # Add an intentional delay
+    # Add an intentional delay (the BOT sends the move when it is over)
 
     if clockSeconds > oppSeconds and clockSeconds > 30:
-        time.sleep(random.randint(5,10))
+        myBot.delay_move(random.randint(5,10))
 
     elif clockSeconds > 60 and b.fullmove_number > 3:
         wait = min(clockSeconds / 70, 10)
-        time.sleep(max(wait, 1))
+        myBot.delay_move(max(wait, 1))
 
     else:
         pass
@@ -170,6 +172,4 @@ if __name__ == '__main__':
     except Exception:
         chamberiBot.wait_for_challenges()
 
-
-STOCKFISH.close()
-WEAKENGINE.close()
+    STOCKFISH.close()
@@ -0,0 +1,506 @@
+#!/usr/bin/env python3
+
+import sys
+
+# Must install python-chess for the following:
+import chess
+import chess.polyglot
+
+'''
+  Compact 0x88 board for the inner loop of SimpleEngine.
+
+  Squares are 0x88 indices (rank * 16 + file), pieces are python-chess piece types
+  with the sign of their color (+ White, - Black, 0 empty), and moves are ints:
+      from | to << 7 | promotion << 14 | flag << 17
+  Moves are generated pseudo-legally and made/unmade in place; a move is legal
+  if, after making it, 'illegal()' is false. Material plus piece-square score and
+  the polyglot Zobrist hash are kept up to date incrementally.
+'''
+
+WHITE, BLACK = 1, -1
+PAWN, KNIGHT, BISHOP, ROOK, QUEEN, KING = chess.PAWN, chess.KNIGHT, chess.BISHOP, chess.ROOK, chess.QUEEN, chess.KING
+
+# Move flags
+DOUBLE_PUSH, EN_PASSANT, CASTLING = 1, 2, 3
+
+KNIGHT_STEPS = (33, 31, 18, 14, -14, -18, -31, -33)
+KING_STEPS = (1, 15, 16, 17, -1, -15, -16, -17)
+BISHOP_STEPS = (15, 17, -15, -17)
+ROOK_STEPS = (1, 16, -1, -16)
+
+SQUARES = [rank * 16 + file for rank in range(8) for file in range(8)]
+
+def to88(square):
+    return (square >> 3) * 16 + (square & 7)
+
+def to64(square):
+    return (square >> 4) * 8 + (square & 7)
+
+# Castling rights (K, Q, k, q) kept when a move starts or ends on a square
+CASTLING_MASK = [15] * 128
+CASTLING_MASK[to88(chess.E1)] = 15 & ~3
+CASTLING_MASK[to88(chess.H1)] = 15 & ~1
+CASTLING_MASK[to88(chess.A1)] = 15 & ~2
+CASTLING_MASK[to88(chess.E8)] = 15 & ~12
+CASTLING_MASK[to88(chess.H8)] = 15 & ~4
+CASTLING_MASK[to88(chess.A8)] = 15 & ~8
+
+# Polyglot Zobrist keys, by (piece + 6) and 0x88 square
+RANDOM = chess.polyglot.POLYGLOT_RANDOM_ARRAY
+PIECE_KEYS = [[0] * 128 for _ in range(13)]
+for pt in chess.PIECE_TYPES:
+    for color in chess.COLORS:
+        for square in chess.SQUARES:
+            PIECE_KEYS[6 + (pt if color else -pt)][to88(square)] = \
+                RANDOM[64 * ((pt - 1) * 2 + int(color)) + square]
+
+CASTLING_KEYS = [0] * 16
+for rights in range(16):
+    for i in range(4):
+        if rights & (1 << i):
+            CASTLING_KEYS[rights] ^= RANDOM[768 + i]
+
+EP_KEYS = [RANDOM[772 + file] for file in range(8)]
+TURN_KEY = RANDOM[780]
+
+
+def move_from(move):
+    return move & 127
+
+def move_to(move):
+    return (move >> 7) & 127
+
+def move_promotion(move):
+    return (move >> 14) & 7
+
+
+class Position(object):
+
+    __slots__ = ('board', 'turn', 'castling', 'ep', 'halfmove', 'kings', 'counts',
+                 'score', 'hash', 'epKey', 'stack', 'values')
+
+    def __init__(self, board, values = None):
+        '''
+          Compact position creator.
+            Input:
+                  board (chess.Board type, from python-chess)
+                 values (optional, list (indexed by piece + 6) of lists (indexed by
+                         0x88 square) with the score of every piece on every square,
+                         from White's point of view and with the sign of the piece)
+        '''
+
+        self.board = [0] * 128
+        self.kings = [0, 0, 0]   # indexed by color: [unused, White, Black]
+        self.counts = [0] * 13
+        self.values = values or [[0] * 128 for _ in range(13)]
+        self.score = 0
+        self.hash = 0
+
+        for (square, piece) in board.piece_map().items():
+            p = piece.piece_type if piece.color else -piece.piece_type
+            self.put(to88(square), p)
+            if piece.piece_type == KING:
+                self.kings[1 if piece.color else -1] = to88(square)
+
+        self.turn = WHITE if board.turn else BLACK
+        self.castling = (1 if board.has_kingside_castling_rights(chess.WHITE) else 0) | \
+                        (2 if board.has_queenside_castling_rights(chess.WHITE) else 0) | \
+                        (4 if board.has_kingside_castling_rights(chess.BLACK) else 0) | \
+                        (8 if board.has_queenside_castling_rights(chess.BLACK) else 0)
+        self.halfmove = board.halfmove_clock
+        self.ep = to88(board.ep_square) if board.ep_square is not None else -1
+        self.epKey = self.ep_key()
+        self.hash ^= CASTLING_KEYS[self.castling] ^ self.epKey ^ (TURN_KEY if self.turn == WHITE else 0)
+        self.stack = []
+
+
+    def put(self, square, piece):
+        self.board[square] = piece
+        self.counts[piece + 6] += 1
+        self.score += self.values[piece + 6][square]
+        self.hash ^= PIECE_KEYS[piece + 6][square]
+
+
+    def ep_key(self):
+        '''
+          Zobrist key of the en passant square, only counted (as in polyglot) if a
+          pawn of the side to move stands next to the pawn that can be captured.
+        '''
+        if self.ep < 0:
+            return 0
+        pawn = self.ep - 16 * self.turn
+        for square in (pawn - 1, pawn + 1):
+            if not square & 0x88 and self.board[square] == PAWN * self.turn:
+                return EP_KEYS[self.ep & 7]
+        return 0
+
+
+    def attacked(self, square, by):
+        '''
+          Whether 'square' is attacked by the pieces of color 'by'.
+        '''
+        board = self.board
+
+        # Pawns attack forward (from the point of view of their color)
+        for step in (15, 17):
+            s = square - step * by
+            if not s & 0x88 and board[s] == PAWN * by:
+                return True
+
+        for step in KNIGHT_STEPS:
+            s = square + step
+            if not s & 0x88 and board[s] == KNIGHT * by:
+                return True
+
+        for step in KING_STEPS:
+            s = square + step
+            if not s & 0x88 and board[s] == KING * by:
+                return True
+
+        bishop, rook, queen = BISHOP * by, ROOK * by, QUEEN * by
+        for step in BISHOP_STEPS:
+            s = square + step
+            while not s & 0x88:
+                p = board[s]
+                if p:
+                    if p == bishop or p == queen:
+                        return True
+                    break
+                s += step
+
+        for step in ROOK_STEPS:
+            s = square + step
+            while not s & 0x88:
+                p = board[s]
+                if p:
+                    if p == rook or p == queen:
+                        return True
+                    break
+                s += step
+
+        return False
+
+
+    def in_check(self):
+        return self.attacked(self.kings[self.turn], -self.turn)
+
+
+    def illegal(self):
+        '''
+          Whether the last move made left its own king in check.
+        '''
+        return self.attacked(self.kings[-self.turn], self.turn)
+
+
+    def generate(self, moves, capturesOnly = False):
+        '''
+          Append the pseudo-legal moves of the side to move to the list 'moves'.
+        '''
+        board, turn = self.board, self.turn
+        append = moves.append
+
+        for frm in SQUARES:
+            p = board[frm] * turn
+            if p <= 0:
+                continue
+
+            if p == PAWN:
+                forward = 16 * turn
+                lastRank = 7 if turn == WHITE else 0
+                to = frm + forward
+                promote = (to >> 4) == lastRank
+
+                if not capturesOnly or promote:
+                    if not to & 0x88 and board[to] == 0:
+                        if promote:
+                            for promotion in (QUEEN, KNIGHT, ROOK, BISHOP):
+                                append(frm | to << 7 | promotion << 14)
+                        else:
+                            append(frm | to << 7)
+                            to2 = to + forward
+                            if (frm >> 4) == (1 if turn == WHITE else 6) and board[to2] == 0:
+                                append(frm | to2 << 7 | DOUBLE_PUSH << 17)
+
+                for to in (frm + forward - 1, frm + forward + 1):
+                    if to & 0x88:
+                        continue
+                    if board[to] * turn < 0:
+                        if promote:
+                            for promotion in (QUEEN, KNIGHT, ROOK, BISHOP):
+                                append(frm | to << 7 | promotion << 14)
+                        else:
+                            append(frm | to << 7)
+                    elif to == self.ep:
+                        append(frm | to << 7 | EN_PASSANT << 17)
+
+            elif p == KNIGHT or p == KING:
+                for step in (KNIGHT_STEPS if p == KNIGHT else KING_STEPS):
+                    to = frm + step
+                    if not to & 0x88:
+                        q = board[to] * turn
+                        if q < 0 or (q == 0 and not capturesOnly):
+                            append(frm | to << 7)
+
+                if p == KING and not capturesOnly:
+                    self.generate_castling(frm, append)
+
+            else:
+                steps = BISHOP_STEPS if p == BISHOP else ROOK_STEPS if p == ROOK else KING_STEPS
+                for step in steps:
+                    to = frm + step
+                    while not to & 0x88:
+                        q = board[to] * turn
+                        if q > 0:
+                            break
+                        if q < 0:
+                            append(frm | to << 7)
+                            break
+                        if not capturesOnly:
+                            append(frm | to << 7)
+                        to += step
+
+        return moves
+
+
+    def generate_castling(self, frm, append):
+        board, turn = self.board, self.turn
+        (kingside, queenside) = (1, 2) if turn == WHITE else (4, 8)
+        if not self.castling & (kingside | queenside) or self.attacked(frm, -turn):
+            return
+
+        if self.castling & kingside and board[frm + 1] == 0 and board[frm + 2] == 0 and \
+           not self.attacked(frm + 1, -turn) and not self.attacked(frm + 2, -turn):
+            append(frm | (frm + 2) << 7 | CASTLING << 17)
+
+        if self.castling & queenside and board[frm - 1] == 0 and board[frm - 2] == 0 and \
+           board[frm - 3] == 0 and not self.attacked(frm - 1, -turn) and not self.attacked(frm - 2, -turn):
+            append(frm | (frm - 2) << 7 | CASTLING << 17)
+
+
+    def captured(self, move):
+        '''
+          Piece type captured by a move (0 if none).
+        '''
+        if move >> 17 == EN_PASSANT:
+            return PAWN
+        return abs(self.board[(move >> 7) & 127])
+
+
+    def make(self, move):
+        '''
+          Make a (pseudo-legal) move in place.
+        '''
+        board, turn, values = self.board, self.turn, self.values
+        frm, to = move & 127, (move >> 7) & 127
+        promotion, flag = (move >> 14) & 7, move >> 17
+        piece = board[frm]
+        captured = board[to]
+
+        self.stack.append((move, captured, self.castling, self.ep, self.epKey,
+                           self.halfmove, self.score, self.hash))
+
+        score, h = self.score, self.hash
+        h ^= self.epKey ^ CASTLING_KEYS[self.castling] ^ TURN_KEY
+
+        # Remove the captured piece
+        if flag == EN_PASSANT:
+            square = to - 16 * turn
+            pawn = board[square]
+            board[square] = 0
+            self.counts[pawn + 6] -= 1
+            score -= values[pawn + 6][square]
+            h ^= PIECE_KEYS[pawn + 6][square]
+
+        elif captured:
+            self.counts[captured + 6] -= 1
+            score -= values[captured + 6][to]
+            h ^= PIECE_KEYS[captured + 6][to]
+
+        # Move the piece (promoting it)
+        placed = promotion * turn if promotion else piece
+        board[frm] = 0
+        board[to] = placed
+        score += values[placed + 6][to] - values[piece + 6][frm]
+        h ^= PIECE_KEYS[piece + 6][frm] ^ PIECE_KEYS[placed + 6][to]
+        if promotion:
+            self.counts[piece + 6] -= 1
+            self.counts[placed + 6] += 1
+
+        if piece * turn == KING:
+            self.kings[turn] = to
+
+            if flag == CASTLING:
+                (rookFrom, rookTo) = (frm + 3, frm + 1) if to > frm else (frm - 4, frm - 1)
+                rook = board[rookFrom]
+                board[rookFrom] = 0
+                board[rookTo] = rook
+                score += values[rook + 6][rookTo] - values[rook + 6][rookFrom]
+                h ^= PIECE_KEYS[rook + 6][rookFrom] ^ PIECE_KEYS[rook + 6][rookTo]
+
+        self.castling &= CASTLING_MASK[frm] & CASTLING_MASK[to]
+        self.halfmove = 0 if captured or piece * turn == PAWN else self.halfmove + 1
+        self.ep = (frm + to) >> 1 if flag == DOUBLE_PUSH else -1
+        self.turn = -turn
+        self.epKey = self.ep_key()
+
+        self.score = score
+        self.hash = h ^ self.epKey ^ CASTLING_KEYS[self.castling]
+
+
+    def unmake(self):
+        '''
+          Take back the last move made.
+        '''
+        (move, captured, self.castling, self.ep, self.epKey,
+         self.halfmove, self.score, self.hash) = self.stack.pop()
+
+        board = self.board
+        turn = self.turn = -self.turn
+        frm, to = move & 127, (move >> 7) & 127
+        promotion, flag = (move >> 14) & 7, move >> 17
+
+        placed = board[to]
+        piece = PAWN * turn if promotion else placed
+        board[frm] = piece
+        board[to] = captured
+
+        if captured:
+            self.counts[captured + 6] += 1
+
+        if promotion:
+            self.counts[placed + 6] -= 1
+            self.counts[piece + 6] += 1
+
+        if flag == EN_PASSANT:
+            board[to - 16 * turn] = -PAWN * turn
+            self.counts[-PAWN * turn + 6] += 1
+
+        elif piece * turn == KING:
+            self.kings[turn] = frm
+
+            if flag == CASTLING:
+                (rookFrom, rookTo) = (frm + 3, frm + 1) if to > frm else (frm - 4, frm - 1)
+                board[rookFrom] = board[rookTo]
+                board[rookTo] = 0
+
+
+    def legal_moves(self):
+        '''
+          List of the legal moves (slow, for the API boundary and for tests).
+        '''
+        output = []
+        for move in self.generate([]):
+            self.make(move)
+            if not self.illegal():
+                output.append(move)
+            self.unmake()
+        return output
+
+
+    def has_legal_move(self):
+        for move in self.generate([]):
+            self.make(move)
+            illegal = self.illegal()
+            self.unmake()
+            if not illegal:
+                return True
+        return False
+
+
+    def insufficient_material(self):
+        '''
+          Whether only kings and at most one minor piece are left.
+        '''
+        counts = self.counts
+        for p in (PAWN, ROOK, QUEEN):
+            if counts[6 + p] or counts[6 - p]:
+                return False
+        return counts[6 + KNIGHT] + counts[6 - KNIGHT] + counts[6 + BISHOP] + counts[6 - BISHOP] <= 1
+
+
+    def to_move(self, move):
+        '''
+          Convert a move into a chess.Move.
+        '''
+        promotion = (move >> 14) & 7
+        return chess.Move(to64(move & 127), to64((move >> 7) & 127), promotion or None)
+
+
+    def from_move(self, move):
+        '''
+          Convert a (legal) chess.Move into a move of this position (None if illegal).
+        '''
+        for m in self.legal_moves():
+            if to64(m & 127) == move.from_square and to64((m >> 7) & 127) == move.to_square and \
+               ((m >> 14) & 7 or None) == move.promotion:
+                return m
+        return None
+
+
+def perft(position, depth):
+    '''
+      Number of legal move sequences of a given length.
+    '''
+    if depth == 0:
+        return 1
+
+    nodes = 0
+    for move in position.generate([]):
+        position.make(move)
+        if not position.illegal():
+            nodes += perft(position, depth - 1)
+        position.unmake()
+
+    return nodes
+
+
+def chess_perft(board, depth):
+    '''
+      Reference perft computed with python-chess.
+    '''
+    if depth == 0:
+        return 1
+
+    nodes = 0
+    for move in board.legal_moves:
+        board.push(move)
+        nodes += chess_perft(board, depth - 1)
+        board.pop()
+
+    return nodes
+
+
+# Standard perft positions (from the Chess Programming Wiki)
+PERFT_FENS = [
+    chess.STARTING_FEN,
+    'r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1',
+    '8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1',
+    'r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1',
+    'rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8',
+    'r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10',
+]
+
+
+def check_perft(fens = PERFT_FENS, depth = 3):
+    '''
+      Cross-check the move generator against python-chess.
+        Output:
+             Boolean (true) if every position gives the same perft counts
+    '''
+    ok = True
+    for fen in fens:
+        board = chess.Board(fen)
+        position = Position(board)
+        for d in range(1, depth + 1):
+            expected, found = chess_perft(board, d), perft(position, d)
+            if expected != found:
+                print("Perft mismatch: %s depth %d: %d (python-chess %d)" % (fen, d, found, expected))
+                ok = False
+
+    return ok
+
+
+if __name__ == '__main__':
+
+    depth = int(sys.argv[1]) if len(sys.argv) > 1 else 3
+    print("OK" if check_perft(depth = depth) else "FAILED")
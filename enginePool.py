@@ -0,0 +1,312 @@
+#!/usr/bin/env python3
+
+import os
+import time
+import queue
+import threading
+import contextlib
+
+# Must install python-chess for the following:
+import chess
+import chess.engine
+import chess.polyglot
+
+import botMetrics
+
+class EnginePool(object):
+
+    def __init__(self, command = './Stockfish/src/stockfish', size = None, options = None):
+        '''
+          Pool of UCI engine processes shared by concurrent games.
+            Input:
+                 command (string: path to the engine binary)
+                    size (optional, number of engine processes, one per core by default)
+                 options (optional, dictionary of UCI options set on every engine)
+        '''
+
+        self.command = command
+        self.size    = size or os.cpu_count() or 1
+        self.options = options or {}
+
+        self.idle    = queue.Queue()
+        self.engines = []
+        self.lock    = threading.Lock()
+        self.restarts = 0
+
+        for _ in range(self.size):
+            self.idle.put(self.spawn())
+
+        # Engine identity, so that analyses of different engines are not mixed up
+        self.name = self.engines[0].id.get('name', command)
+
+
+    def spawn(self):
+        '''
+          Start a new engine process.
+            Output:
+                 engine (chess.engine.SimpleEngine type)
+        '''
+        engine = chess.engine.SimpleEngine.popen_uci(self.command)
+        if self.options:
+            engine.configure(self.options)
+
+        with self.lock:
+            self.engines.append(engine)
+
+        return engine
+
+
+    def discard(self, engine):
+        '''
+          Kill an engine process, ignoring any error (it may be dead already).
+        '''
+        with self.lock:
+            if engine in self.engines:
+                self.engines.remove(engine)
+
+        try:
+            engine.close()
+        except Exception:
+            pass
+
+
+    def restart(self, engine):
+        '''
+          Replace a crashed engine by a fresh process.
+            Output:
+                 engine (the new chess.engine.SimpleEngine)
+        '''
+        self.discard(engine)
+        self.restarts += 1
+        return self.spawn()
+
+
+    def healthy(self, engine):
+        '''
+          Check that an engine process is alive and responsive.
+        '''
+        try:
+            engine.ping()
+            return True
+        except Exception:
+            return False
+
+
+    @contextlib.contextmanager
+    def engine(self, timeout = None):
+        '''
+          Borrow an engine from the pool, waiting for one to be free.
+          The engine is checked before being handed out and replaced if it crashed
+          while in use, so it always goes back to the pool in a good state.
+            Input:
+                 timeout (optional, seconds to wait for a free engine)
+
+            Usage:
+                 with POOL.engine() as engine:
+                     info = engine.analyse(board, limit)
+        '''
+        engine = self.idle.get(timeout = timeout)
+
+        try:
+            if not self.healthy(engine):
+                engine = self.restart(engine)
+
+            yield engine
+
+        except (chess.engine.EngineTerminatedError, chess.engine.EngineError):
+            engine = self.restart(engine)
+            raise
+
+        finally:
+            self.idle.put(engine)
+
+
+    def analyse(self, board, limit, **kwargs):
+        '''
+          Analyse a position on a pooled engine, retrying once if the engine crashes.
+            Input:
+                 board (chess.Board type, from python-chess)
+                 limit (chess.engine.Limit type)
+                kwargs (passed to chess.engine.SimpleEngine.analyse, e.g. multipv)
+
+            Output:
+                  info (as returned by chess.engine.SimpleEngine.analyse)
+        '''
+        with botMetrics.span('engine'):
+            try:
+                with self.engine() as engine:
+                    return engine.analyse(board, limit, **kwargs)
+
+            except chess.engine.EngineTerminatedError:
+                botMetrics.count('engineCrashes')
+                with self.engine() as engine:
+                    return engine.analyse(board, limit, **kwargs)
+
+
+    def close(self):
+        '''
+          Terminate all the engine processes.
+        '''
+        for engine in list(self.engines):
+            self.discard(engine)
+
+
+class Ponderer(object):
+
+    def __init__(self, pool, maxAge = 120):
+        '''
+          Ponder on the opponent's clock using engines borrowed from a pool.
+          A ponder search is keyed by the position we left to the opponent, so the
+          next search of the same game finds it whether or not the guess was right.
+            Input:
+                  pool (EnginePool)
+                maxAge (optional, seconds after which a forgotten ponder is aborted)
+        '''
+
+        self.pool   = pool
+        self.maxAge = maxAge
+        self.ponders = {}
+        self.lock   = threading.Lock()
+        self.hits   = 0
+        self.misses = 0
+
+
+    def start(self, board, move, reply, multipv = 1):
+        '''
+          Start analysing the position after our move and the expected reply.
+          Nothing is done if fewer than two engines are idle, so that pondering
+          never delays a real search.
+            Input:
+                 board (chess.Board type, position before our move, left unchanged)
+                  move (chess.Move type, the move we are playing)
+                 reply (chess.Move type, the expected reply, second move of the PV)
+               multipv (optional, number of lines to analyse)
+        '''
+        self.sweep()
+
+        if self.pool.idle.qsize() < 2:
+            return
+
+        try:
+            engine = self.pool.idle.get_nowait()
+        except queue.Empty:
+            return
+
+        ponderBoard = board.copy()
+        ponderBoard.push(move)
+        key = chess.polyglot.zobrist_hash(ponderBoard)
+
+        try:
+            ponderBoard.push(reply)
+            analysis = engine.analysis(ponderBoard, multipv = multipv)
+
+        except Exception:
+            self.pool.idle.put(self.pool.restart(engine))
+            return
+
+        with self.lock:
+            old = self.ponders.pop(key, None)
+            self.ponders[key] = (chess.polyglot.zobrist_hash(ponderBoard), engine,
+                                 analysis, time.time())
+
+        if old:
+            self.release(old)
+
+
+    def release(self, ponder):
+        '''
+          Abort a ponder search and give its engine back to the pool.
+            Output:
+                  list of info dictionaries (one per line) found by the search
+        '''
+        _, engine, analysis, _ = ponder
+
+        try:
+            analysis.stop()
+            analysis.wait()
+            info = analysis.multipv
+            self.pool.idle.put(engine)
+            return info
+
+        except Exception:
+            self.pool.idle.put(self.pool.restart(engine))
+            return None
+
+
+    def sweep(self):
+        '''
+          Abort the ponder searches that nobody collected (e.g. finished games).
+        '''
+        now = time.time()
+        with self.lock:
+            old = [k for (k, p) in self.ponders.items() if now - p[3] > self.maxAge]
+            old = [self.ponders.pop(k) for k in old]
+
+        for ponder in old:
+            self.release(ponder)
+
+
+    def hit(self, board, seconds, depth = None):
+        '''
+          Collect the ponder search of the current position, if any.
+          On a ponderhit the search continues until it has run for 'seconds'
+          (returning at once if it already did); otherwise it is aborted.
+          With a 'depth', the search stops as soon as it reaches it, and
+          'seconds' is only the longest wait: a shallower result is dropped.
+            Input:
+                 board (chess.Board type, position after the opponent move, left unchanged)
+               seconds (time we would have spent on a fresh search)
+                 depth (optional, depth of the search asked for)
+
+            Output:
+                  list of info dictionaries (as analyse with multipv), or None on a miss
+                  (or if the search did not reach 'depth')
+        '''
+        if not board.move_stack:
+            return None
+
+        reply = board.pop()
+        key = chess.polyglot.zobrist_hash(board)
+        board.push(reply)
+
+        with self.lock:
+            ponder = self.ponders.pop(key, None)
+
+        if not ponder:
+            return None
+
+        if ponder[0] != chess.polyglot.zobrist_hash(board):
+            self.misses += 1
+            botMetrics.count('ponderMisses')
+            self.release(ponder)
+            return None
+
+        self.hits += 1
+        botMetrics.count('ponderHits')
+        deadline = ponder[3] + seconds
+
+        if depth:
+            analysis = ponder[2]
+            while time.time() < deadline and reached(analysis.multipv) < depth:
+                time.sleep(0.005)
+
+        elif deadline > time.time():
+            time.sleep(deadline - time.time())
+
+        info = self.release(ponder)
+        complete = info and all('pv' in line and 'score' in line for line in info)
+
+        if depth and complete and reached(info) < depth:
+            botMetrics.count('ponderShallow')
+            return None
+
+        return info if complete else None
+
+
+def reached(info):
+    '''
+      Depth completed by all the lines of an analysis (0 if unknown).
+        Input:
+             info (list of info dictionaries, one per line)
+    '''
+    return min((line.get('depth', 0) for line in info), default = 0)
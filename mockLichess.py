@@ -0,0 +1,944 @@
+#!/usr/bin/env python3
+
+'''
+  Local stand-in for the part of the Lichess BOT API used by myBot.Bot, to
+  load-test BOTs end to end without touching lichess.org.
+
+  Usage:
+      python mockLichess.py [--games 200] [--clock 60] [--increment 0] [--think 0.1]
+                            [--selector module:function] [--output report.json]
+      python mockLichess.py --serve [--port 8080] [--bot NAME:TOKEN ...] [--opponents 10]
+
+  The first form starts the server and a BOT (by default one playing random
+  moves, or any moveSelector), lets scripted opponents challenge the BOT and
+  reports the round trip of its moves and the throughput. The second one only
+  serves, for BOTs run elsewhere with api = 'http://127.0.0.1:8080/api/', which
+  can challenge the scripted opponents 'Opponent1', 'Opponent2'...
+'''
+
+import os
+import re
+import sys
+import json
+import time
+import heapq
+import queue
+import random
+import argparse
+import importlib
+import itertools
+import threading
+import contextlib
+import collections
+import http.server
+import urllib.parse
+
+# Must install python-chess for the following:
+import chess
+
+import myBot
+import botMetrics
+import admission
+import rateLimit
+
+# Seconds between the empty lines sent on idle streams, as Lichess does
+KEEP_ALIVE = 6
+
+# Sent to a stream queue to end the stream
+END = None
+
+
+def speed(seconds, inc):
+    '''
+      Lichess speed of a time control.
+        Input:
+             seconds (clock initial time in seconds)
+                 inc (clock increment in seconds)
+
+        Output:
+             string ('ultraBullet', 'bullet', 'blitz', 'rapid' or 'classical')
+    '''
+    estimate = seconds + 40 * inc
+    if estimate < 30:   return 'ultraBullet'
+    if estimate < 180:  return 'bullet'
+    if estimate < 480:  return 'blitz'
+    if estimate < 1500: return 'rapid'
+    return 'classical'
+
+
+def percentiles(samples):
+    '''
+      Summary, in milliseconds, of a list of durations in seconds.
+    '''
+    if not samples:
+        return { 'count' : 0 }
+
+    samples = sorted(samples)
+    pick = lambda q: 1000 * samples[min(len(samples) - 1, int(q * len(samples)))]
+    return { 'count' : len(samples), 'mean' : 1000 * sum(samples) / len(samples),
+             'p50' : pick(0.5), 'p90' : pick(0.9), 'p99' : pick(0.99), 'max' : 1000 * samples[-1] }
+
+
+@myBot.board_selector
+def random_mover(board, clockSeconds, oppSeconds):
+    '''
+      Default moveSelector of the load tests: a random legal move, no chat.
+    '''
+    return random.choice(list(board.legal_moves)).uci(), None
+
+
+class Opponent(object):
+    '''
+      A scripted player: it plays the moves of its script while they are legal,
+      then random legal moves, each after 'think' seconds (+-50%), and accepts
+      challenges with probability 'acceptRate'.
+    '''
+
+    def __init__(self, name, think = 0.1, script = None, acceptRate = 1.0, seed = None):
+        self.name = name
+        self.id = name.lower()
+        self.think = think
+        self.script = script.split() if isinstance(script, str) else list(script or [])
+        self.acceptRate = acceptRate
+        self.random = random.Random(seed)
+
+    def delay(self):
+        return self.think * self.random.uniform(0.5, 1.5)
+
+    def accepts(self, challenge):
+        return self.random.random() < self.acceptRate
+
+    def move(self, board):
+        ply = board.ply()
+        if ply < len(self.script):
+            move = chess.Move.from_uci(self.script[ply])
+            if board.is_legal(move):
+                return move
+        return self.random.choice(sorted(board.legal_moves, key = lambda m: m.uci()))
+
+
+class MockGame(object):
+    '''
+      A game on the mock server. Clocks are in milliseconds; the one of the
+      side to move runs since 'turnStart'.
+    '''
+
+    def __init__(self, gameID, white, black, seconds, inc, rated = False):
+        self.id = gameID
+        self.white = white
+        self.black = black
+        self.board = chess.Board()
+        self.moves = []
+        self.clock = { chess.WHITE : 1000 * seconds, chess.BLACK : 1000 * seconds }
+        self.seconds = seconds
+        self.inc = 1000 * inc
+        self.speed = speed(seconds, inc)
+        self.rated = rated
+        self.status = 'started'
+        self.winner = None
+        self.createdAt = int(time.time() * 1000)
+        self.turnStart = time.monotonic()
+        self.listeners = []
+
+    def player(self, color):
+        return self.white if color == chess.WHITE else self.black
+
+    def color(self, user):
+        if user == self.white['id']:  return chess.WHITE
+        if user == self.black['id']:  return chess.BLACK
+        return None
+
+    def remaining(self, now):
+        clock = dict(self.clock)
+        if self.status == 'started':
+            clock[self.board.turn] -= int(1000 * (now - self.turnStart))
+        return clock
+
+    def state(self, now):
+        clock = self.remaining(now)
+        output = { 'type' : 'gameState', 'moves' : ' '.join(self.moves),
+                   'wtime' : max(0, clock[chess.WHITE]), 'btime' : max(0, clock[chess.BLACK]),
+                   'winc' : self.inc, 'binc' : self.inc, 'status' : self.status }
+        if self.winner:
+            output['winner'] = self.winner
+        return output
+
+    def full(self, now):
+        return { 'type' : 'gameFull', 'id' : self.id, 'rated' : self.rated,
+                 'variant' : { 'key' : 'standard', 'name' : 'Standard' }, 'speed' : self.speed,
+                 'clock' : { 'initial' : 1000 * self.seconds, 'increment' : self.inc },
+                 'createdAt' : self.createdAt, 'white' : self.white, 'black' : self.black,
+                 'initialFen' : 'startpos', 'state' : self.state(now) }
+
+
+# (method, path relative to /api/, label of the request counters, MockLichess method, is a stream)
+ROUTES = [(method, re.compile(pattern), label, name, stream) for (method, pattern, label, name, stream) in [
+    ('GET',  r'stream/event',                 'stream/event',           'open_events', True),
+    ('GET',  r'bot/game/stream/(\w+)',        'bot/game/stream',        'open_game',   True),
+    ('POST', r'challenge/(\w+)/accept',       'challenge/accept',       'accept',      False),
+    ('POST', r'challenge/(\w+)/decline',      'challenge/decline',      'decline',     False),
+    ('POST', r'challenge/(\w+)/cancel',       'challenge/cancel',       'cancel',      False),
+    ('POST', r'challenge/([\w-]+)',           'challenge',              'challenge',   False),
+    ('POST', r'bot/game/(\w+)/move/(\w+)',    'bot/game/move',          'move',        False),
+    ('POST', r'bot/game/(\w+)/chat',          'bot/game/chat',          'chat',        False),
+    ('POST', r'bot/game/(\w+)/abort',         'bot/game/abort',         'abort',       False),
+    ('POST', r'bot/game/(\w+)/resign',        'bot/game/resign',        'resign',      False),
+    ('POST', r'round/(\w+)/add-time/(\d+)',   'round/add-time',         'add_time',    False),
+]]
+
+
+class MockHandler(http.server.BaseHTTPRequestHandler):
+    '''
+      HTTP/1.1 keep-alive handler: JSON replies, chunked ndjson streams.
+    '''
+
+    protocol_version = 'HTTP/1.1'
+    mock = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self.dispatch('GET')
+
+    def do_POST(self):
+        self.dispatch('POST')
+
+    def dispatch(self, method):
+        length = int(self.headers.get('Content-Length') or 0)
+        form = dict(urllib.parse.parse_qsl(self.rfile.read(length).decode())) if length else {}
+        path = urllib.parse.urlparse(self.path).path
+
+        route = None
+        if path.startswith('/api/'):
+            for (verb, pattern, label, name, stream) in ROUTES:
+                match = pattern.fullmatch(path[len('/api/'):])
+                if verb == method and match:
+                    route = (label, name, stream)
+                    break
+
+        if route is None:
+            return self.reply(404, { 'error' : 'Not found' })
+
+        auth = self.headers.get('Authorization', '')
+        user = self.mock.user(auth[len('Bearer '):] if auth.startswith('Bearer ') else None)
+        if user is None:
+            return self.reply(401, { 'error' : 'No such token' })
+
+        (label, name, stream) = route
+        self.mock.count(label)
+
+        penalty = self.mock.limited(user)
+        if penalty:
+            return self.reply(429, { 'error' : 'Too many requests. Try again later.' },
+                              { 'Retry-After' : '%g' % penalty })
+
+        if stream:
+            opened = getattr(self.mock, name)(user, *match.groups())
+            if opened is None:
+                return self.reply(404, { 'error' : 'Not found' })
+            self.stream(*opened)
+
+        else:
+            self.reply(*getattr(self.mock, name)(user, *match.groups(), form))
+
+    def reply(self, status, output, headers = {}):
+        data = json.dumps(output).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for (header, value) in headers.items():
+            self.send_header(header, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def stream(self, lines, listeners):
+        '''
+          Write the events put in the queue 'lines' until END, with keep-alive
+          empty lines in between, then stop listening.
+        '''
+        try:
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/x-ndjson')
+            self.send_header('Transfer-Encoding', 'chunked')
+            self.end_headers()
+
+            while True:
+                try:
+                    event = lines.get(timeout = self.mock.keepAlive)
+                    if event is END:
+                        break
+                    data = json.dumps(event).encode() + b'\n'
+                except queue.Empty:
+                    data = b'\n'
+                self.wfile.write(b'%x\r\n%s\r\n' % (len(data), data))
+
+            self.wfile.write(b'0\r\n\r\n')
+
+        except (BrokenPipeError, ConnectionResetError):
+            self.close_connection = True
+
+        finally:
+            self.mock.unsubscribe(lines, listeners)
+
+
+class Server(http.server.ThreadingHTTPServer):
+    # Bursts of hundreds of games open their streams at once
+    request_queue_size = 1024
+
+    def handle_error(self, request, client_address):
+        # Clients dropping keep-alive connections are not errors
+        if not isinstance(sys.exc_info()[1], (ConnectionResetError, BrokenPipeError)):
+            http.server.ThreadingHTTPServer.handle_error(self, request, client_address)
+
+
+class MockLichess(object):
+
+    def __init__(self, host = '127.0.0.1', port = 0, maxPlies = 200, keepAlive = KEEP_ALIVE, seed = 2020,
+                 rateLimit = None, penalty = 60):
+        '''
+          Mock Lichess server creator (call 'start' to serve).
+            Input:
+                      host (optional, address to listen at)
+                      port (optional, 0 picks a free port; see 'url')
+                  maxPlies (optional, games reaching this length are drawn)
+                 keepAlive (optional, seconds between keep-alive lines of idle streams)
+                      seed (optional, seed of the challenge and game identifiers)
+                 rateLimit (optional, (requests per second, burst) allowed per account,
+                            unlimited by default)
+                   penalty (optional, seconds an account over the limit gets 429s,
+                            announced in Retry-After)
+        '''
+        self.maxPlies = maxPlies
+        self.keepAlive = keepAlive
+        self.rateLimit = rateLimit
+        self.penalty = penalty
+        self.buckets = {}                           # user id -> [tokens, updated, blocked until]
+
+        self.users = {}                             # token -> user id
+        self.profiles = {}                          # user id -> { 'id', 'name', 'rating' }
+        self.opponents = {}                         # user id -> Opponent
+        self.events = collections.defaultdict(list) # user id -> open event streams
+        self.challenges = {}
+        self.games = {}
+
+        self.lock = threading.RLock()
+        self.random = random.Random(seed)
+        self.timers = []
+        self.ticket = itertools.count()
+        self.wakeup = threading.Condition(self.lock)
+        self.closing = False
+
+        # Load test measures
+        self.requests = collections.Counter()
+        self.roundTrips = []
+        self.botMoves = 0
+        self.opponentMoves = 0
+        self.rejectedMoves = 0
+        self.chatLines = 0
+        self.addTime = 0
+        self.disconnects = 0
+        self.rateLimited = 0
+        self.declined = collections.Counter()
+        self.finished = collections.Counter()
+
+        handler = type('Handler', (MockHandler,), { 'mock' : self })
+        self.server = Server((host, port), handler)
+        self.url = 'http://%s:%d/api/' % self.server.server_address[:2]
+        self.threads = []
+
+
+    def start(self):
+        '''
+          Serve and run the scripted opponents in background threads.
+        '''
+        for target in (self.server.serve_forever, self.run_timers):
+            thr = threading.Thread(target = target, daemon = True)
+            thr.start()
+            self.threads.append(thr)
+
+
+    def close(self):
+        '''
+          End all the streams and stop serving.
+        '''
+        with self.lock:
+            self.closing = True
+            self.wakeup.notify_all()
+            for lines in [q for qs in self.events.values() for q in qs] + \
+                         [q for g in self.games.values() for q in g.listeners]:
+                lines.put(END)
+
+        self.server.shutdown()
+        self.server.server_close()
+
+
+    def disconnect(self):
+        '''
+          End all the open streams, as a network drop would, leaving the games
+          and challenges as they are.
+        '''
+        with self.lock:
+            self.disconnects += 1
+            for lines in [q for qs in self.events.values() for q in qs] + \
+                         [q for g in self.games.values() for q in g.listeners]:
+                lines.put(END)
+
+
+    def register(self, name, token):
+        '''
+          Add a BOT account.
+            Input:
+                  name (string: BOT name)
+                 token (string: token the BOT authenticates with)
+
+            Output:
+                 user id
+        '''
+        with self.lock:
+            user = name.lower()
+            self.users[token] = user
+            self.profiles[user] = { 'id' : user, 'name' : name, 'rating' : 1500, 'title' : 'BOT' }
+            return user
+
+
+    def add_opponent(self, opponent):
+        '''
+          Add a scripted player (Opponent type).
+        '''
+        with self.lock:
+            self.opponents[opponent.id] = opponent
+            self.profiles[opponent.id] = { 'id' : opponent.id, 'name' : opponent.name, 'rating' : 1500 }
+            return opponent
+
+
+    def user(self, token):
+        with self.lock:
+            return self.users.get(token)
+
+
+    def listening(self, user):
+        with self.lock:
+            return len(self.events[user]) > 0
+
+
+    def limited(self, user):
+        '''
+          Take a token of the user's bucket.
+            Output:
+                 seconds the user must wait (0 if the request is allowed)
+        '''
+        if not self.rateLimit:
+            return 0
+
+        (rate, burst) = self.rateLimit
+        now = time.monotonic()
+        with self.lock:
+            bucket = self.buckets.setdefault(user, [burst, now, 0])
+            bucket[0] = min(burst, bucket[0] + (now - bucket[1]) * rate)
+            bucket[1] = now
+
+            if bucket[2] <= now and bucket[0] >= 1:
+                bucket[0] -= 1
+                return 0
+
+            if bucket[2] <= now:
+                bucket[2] = now + self.penalty
+            self.rateLimited += 1
+            return bucket[2] - now
+
+
+    def count(self, label):
+        with self.lock:
+            self.requests[label] += 1
+
+
+    # Scheduler of the scripted opponents and the clocks: the callbacks run in a
+    # single thread, holding the lock
+
+    def later(self, seconds, function, *args):
+        heapq.heappush(self.timers, (time.monotonic() + seconds, next(self.ticket), function, args))
+        self.wakeup.notify()
+
+
+    def run_timers(self):
+        with self.lock:
+            while not self.closing:
+                now = time.monotonic()
+                if not self.timers:
+                    self.wakeup.wait()
+                elif self.timers[0][0] > now:
+                    self.wakeup.wait(self.timers[0][0] - now)
+                else:
+                    (when, ticket, function, args) = heapq.heappop(self.timers)
+                    function(*args)
+
+
+    # Streams
+
+    def publish(self, listeners, event):
+        for lines in listeners:
+            lines.put(event)
+
+
+    def unsubscribe(self, lines, listeners):
+        with self.lock:
+            if lines in listeners:
+                listeners.remove(lines)
+
+
+    def open_events(self, user):
+        '''
+          Output:
+               (queue, listeners) of a new event stream, starting with the
+               games in progress and the pending challenges, as Lichess does
+        '''
+        with self.lock:
+            lines = queue.Queue()
+            for game in self.games.values():
+                color = game.color(user)
+                if color is not None and game.status == 'started':
+                    lines.put(self.game_start(game, color))
+            for challenge in self.challenges.values():
+                if challenge['destUser']['id'] == user:
+                    lines.put({ 'type' : 'challenge', 'challenge' : challenge })
+
+            self.events[user].append(lines)
+            return (lines, self.events[user])
+
+
+    def open_game(self, user, gameID):
+        with self.lock:
+            game = self.games.get(gameID)
+            if game is None:
+                return None
+
+            lines = queue.Queue()
+            lines.put(game.full(time.monotonic()))
+            if game.status != 'started':
+                lines.put(END)
+            game.listeners.append(lines)
+            return (lines, game.listeners)
+
+
+    # Challenges
+
+    def new_challenge(self, challenger, dest, seconds, inc, rated):
+        challengeID = ''.join(self.random.choice('abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789')
+                              for _ in range(8))
+        challenge = { 'id' : challengeID, 'status' : 'created', 'rated' : rated,
+                      'challenger' : self.profiles[challenger], 'destUser' : self.profiles[dest],
+                      'variant' : { 'key' : 'standard', 'name' : 'Standard' }, 'speed' : speed(seconds, inc),
+                      'timeControl' : { 'type' : 'clock', 'limit' : seconds, 'increment' : inc,
+                                        'show' : '%g+%d' % (seconds / 60, inc) },
+                      'color' : 'random' }
+        self.challenges[challengeID] = challenge
+
+        if dest in self.opponents:
+            self.later(self.opponents[dest].delay(), self.answer, challengeID)
+        else:
+            self.publish(self.events[dest], { 'type' : 'challenge', 'challenge' : challenge })
+
+        return challenge
+
+
+    def challenge_from(self, opponent, user, seconds = 180, inc = 0, rated = False):
+        '''
+          Make a scripted opponent challenge a BOT.
+            Input:
+                 opponent (Opponent type)
+                     user (user id of the BOT)
+                  seconds, inc, rated (time control, as in myBot.Bot.challenge_user)
+
+            Output:
+                 challenge (dictionary, as sent in the event stream)
+        '''
+        with self.lock:
+            return self.new_challenge(opponent.id, user, seconds, inc, rated)
+
+
+    def answer(self, challengeID):
+        challenge = self.challenges.get(challengeID)
+        if challenge is None:
+            return
+        if self.opponents[challenge['destUser']['id']].accepts(challenge):
+            self.accept(challenge['destUser']['id'], challengeID, {})
+        else:
+            self.decline(challenge['destUser']['id'], challengeID, {})
+
+
+    def challenge(self, user, username, form):
+        with self.lock:
+            dest = username.lower()
+            if dest not in self.profiles:
+                return 404, { 'error' : 'No such user' }
+
+            challenge = self.new_challenge(user, dest, int(form.get('clock.limit', 180)),
+                                           int(form.get('clock.increment', 0)), form.get('rated') == 'true')
+            return 200, { 'challenge' : challenge }
+
+
+    def accept(self, user, challengeID, form):
+        with self.lock:
+            challenge = self.challenges.get(challengeID)
+            if challenge is None or challenge['destUser']['id'] != user:
+                return 404, { 'error' : 'No such challenge' }
+
+            del self.challenges[challengeID]
+            players = [challenge['challenger'], challenge['destUser']]
+            self.random.shuffle(players)
+            control = challenge['timeControl']
+            game = MockGame(challengeID, players[0], players[1], control['limit'], control['increment'],
+                            challenge['rated'])
+            self.games[challengeID] = game
+
+            for color in chess.COLORS:
+                self.publish(self.events[game.player(color)['id']], self.game_start(game, color))
+
+            self.turn(game)
+            return 200, { 'ok' : True }
+
+
+    def decline(self, user, challengeID, form):
+        with self.lock:
+            challenge = self.challenges.get(challengeID)
+            if challenge is None or challenge['destUser']['id'] != user:
+                return 404, { 'error' : 'No such challenge' }
+
+            del self.challenges[challengeID]
+            challenge['status'] = 'declined'
+            self.declined[form.get('reason', 'generic')] += 1
+            self.publish(self.events[challenge['challenger']['id']],
+                         { 'type' : 'challengeDeclined', 'challenge' : challenge })
+            return 200, { 'ok' : True }
+
+
+    def cancel(self, user, challengeID, form):
+        with self.lock:
+            challenge = self.challenges.get(challengeID)
+            if challenge is None or challenge['challenger']['id'] != user:
+                return 404, { 'error' : 'No such challenge' }
+
+            del self.challenges[challengeID]
+            challenge['status'] = 'canceled'
+            self.publish(self.events[challenge['destUser']['id']],
+                         { 'type' : 'challengeCanceled', 'challenge' : challenge })
+            return 200, { 'ok' : True }
+
+
+    # Games
+
+    def game_start(self, game, color):
+        return { 'type' : 'gameStart', 'game' : { 'id' : game.id, 'gameId' : game.id, 'speed' : game.speed,
+                                                  'color' : chess.COLOR_NAMES[color], 'rated' : game.rated,
+                                                  'opponent' : game.player(not color) } }
+
+
+    def turn(self, game):
+        '''
+          Give the turn to the side to move: start its clock, schedule the flag
+          and, for scripted opponents, their reply.
+        '''
+        game.turnStart = time.monotonic()
+        ply = game.board.ply()
+        self.later(game.clock[game.board.turn] / 1000, self.flag, game, ply)
+
+        opponent = self.opponents.get(game.player(game.board.turn)['id'])
+        if opponent:
+            self.later(opponent.delay(), self.scripted_move, game, opponent, ply)
+
+
+    def flag(self, game, ply):
+        if game.status == 'started' and game.board.ply() == ply and \
+           game.remaining(time.monotonic())[game.board.turn] <= 0:
+            self.finish(game, 'outoftime', not game.board.turn)
+
+
+    def scripted_move(self, game, opponent, ply):
+        if game.status == 'started' and game.board.ply() == ply:
+            self.opponentMoves += 1
+            self.play(game, opponent.move(game.board))
+
+
+    def play(self, game, move):
+        color = game.board.turn
+        game.clock[color] -= int(1000 * (time.monotonic() - game.turnStart))
+        if game.clock[color] <= 0:
+            return self.finish(game, 'outoftime', not color)
+
+        game.clock[color] += game.inc
+        game.board.push(move)
+        game.moves.append(move.uci())
+
+        outcome = game.board.outcome()
+        if outcome:
+            status = { chess.Termination.CHECKMATE : 'mate',
+                       chess.Termination.STALEMATE : 'stalemate' }.get(outcome.termination, 'draw')
+            return self.finish(game, status, outcome.winner)
+
+        if game.board.ply() >= self.maxPlies:
+            return self.finish(game, 'draw')
+
+        self.turn(game)
+        self.publish(game.listeners, game.state(time.monotonic()))
+
+
+    def finish(self, game, status, winner = None):
+        game.status = status
+        game.winner = chess.COLOR_NAMES[winner] if winner is not None else None
+        self.finished[status] += 1
+
+        self.publish(game.listeners, game.state(time.monotonic()))
+        self.publish(game.listeners, END)
+        for color in chess.COLORS:
+            self.publish(self.events[game.player(color)['id']],
+                         { 'type' : 'gameFinish', 'game' : { 'id' : game.id, 'gameId' : game.id } })
+
+
+    def playing(self, user, gameID):
+        '''
+          Output:
+               (game, color of the user) or (None, None)
+        '''
+        game = self.games.get(gameID)
+        color = game.color(user) if game else None
+        return (game, color) if color is not None else (None, None)
+
+
+    def move(self, user, gameID, uci, form):
+        with self.lock:
+            (game, color) = self.playing(user, gameID)
+            if game is None:
+                return 404, { 'error' : 'No such game' }
+
+            try:
+                move = chess.Move.from_uci(uci)
+            except ValueError:
+                move = None
+
+            if game.status != 'started' or game.board.turn != color or \
+               move is None or not game.board.is_legal(move):
+                self.rejectedMoves += 1
+                return 400, { 'error' : 'Not your turn, or game already over' }
+
+            self.roundTrips.append(time.monotonic() - game.turnStart)
+            self.botMoves += 1
+            self.play(game, move)
+            return 200, { 'ok' : True }
+
+
+    def chat(self, user, gameID, form):
+        with self.lock:
+            (game, color) = self.playing(user, gameID)
+            if game is None:
+                return 404, { 'error' : 'No such game' }
+
+            self.chatLines += 1
+            self.publish(game.listeners, { 'type' : 'chatLine', 'room' : form.get('room', 'player'),
+                                           'username' : game.player(color)['name'],
+                                           'text' : form.get('text', '') })
+            return 200, { 'ok' : True }
+
+
+    def add_time(self, user, gameID, seconds, form):
+        with self.lock:
+            (game, color) = self.playing(user, gameID)
+            if game is None or game.status != 'started':
+                return 400, { 'error' : 'Cannot add time' }
+
+            self.addTime += 1
+            game.clock[not color] += 1000 * int(seconds)
+            self.publish(game.listeners, game.state(time.monotonic()))
+            return 200, { 'ok' : True }
+
+
+    def abort(self, user, gameID, form):
+        with self.lock:
+            (game, color) = self.playing(user, gameID)
+            if game is None or game.status != 'started' or game.board.ply() >= 2:
+                return 400, { 'error' : 'This game can no longer be aborted' }
+
+            self.finish(game, 'aborted')
+            return 200, { 'ok' : True }
+
+
+    def resign(self, user, gameID, form):
+        with self.lock:
+            (game, color) = self.playing(user, gameID)
+            if game is None or game.status != 'started':
+                return 400, { 'error' : 'This game is over' }
+
+            self.finish(game, 'resign', not color)
+            return 200, { 'ok' : True }
+
+
+    def report(self, seconds):
+        '''
+          Measures of a load test.
+            Input:
+                 seconds (wall time of the test)
+
+            Output:
+                 dictionary (JSON serializable)
+        '''
+        with self.lock:
+            return { 'games' : len(self.games), 'finished' : dict(self.finished),
+                     'declined' : dict(self.declined), 'seconds' : seconds,
+                     'botMoves' : self.botMoves, 'opponentMoves' : self.opponentMoves,
+                     'movesPerSecond' : self.botMoves / seconds if seconds > 0 else 0,
+                     'roundTripMS' : percentiles(self.roundTrips), 'rejectedMoves' : self.rejectedMoves,
+                     'chatLines' : self.chatLines, 'addTime' : self.addTime, 'disconnects' : self.disconnects,
+                     'rateLimited' : self.rateLimited,
+                     'requests' : dict(self.requests) }
+
+
+def load_test(selector = random_mover, games = 100, seconds = 60, inc = 0, think = 0.1, rate = None,
+              maxPlies = 120, timeout = None, verbose = False, metrics = False, maxGames = None,
+              dropEvery = None, serverRate = None, penalty = 60, botRate = None, botClass = myBot.Bot,
+              **botOptions):
+    '''
+      Play a BOT against scripted opponents on a local mock server.
+        Input:
+                 selector (moveSelector of the BOT)
+                    games (number of opponents challenging the BOT)
+             seconds, inc (time control of the challenges)
+                    think (average seconds the opponents take per move)
+                     rate (optional, challenges per second; all at once by default)
+                 maxPlies (games reaching this length are drawn)
+                  timeout (optional, seconds before giving up on unfinished games)
+                  verbose (optional, keep the output of the BOT)
+                  metrics (optional, add the botMetrics snapshot of the BOT to the report)
+                 maxGames (optional, games the BOT plays at once, see admission.AdmissionControl;
+                           all of them by default, so that none is declined)
+                dropEvery (optional, seconds between simulated drops of all the streams)
+               serverRate (optional, (requests per second, burst) the server allows)
+                  penalty (optional, seconds of 429s when the BOT goes over it)
+                  botRate (optional, (requests per second, burst) of the BOT rate limiter)
+                 botClass (optional, myBot.Bot or a subclass)
+               botOptions (optional, other arguments of the BOT class)
+
+        Output:
+                 dictionary (see MockLichess.report, plus the games 'requested' and
+                 the counters of the BOT rate limiter)
+    '''
+    mock = MockLichess(maxPlies = maxPlies, rateLimit = serverRate, penalty = penalty)
+    user = mock.register('LoadTestBot', 'load-test-token')
+    opponents = [mock.add_opponent(Opponent('Opponent%d' % i, think = think, seed = i))
+                 for i in range(1, games + 1)]
+    mock.start()
+
+    if metrics:
+        botOptions['metrics'] = botMetrics.Metrics('LoadTestBot')
+    if botRate:
+        botOptions['rateLimiter'] = rateLimit.RateLimiter(*botRate)
+    if 'admissionControl' not in botOptions:
+        botOptions['admissionControl'] = admission.AdmissionControl(maxGames = maxGames or games)
+    bot = botClass('LoadTestBot', 'load-test-token', selector, 'Here you have 10 seconds.',
+                   api = mock.url, **botOptions)
+
+    output = sys.stdout if verbose else open(os.devnull, 'w')
+    with contextlib.redirect_stdout(output):
+        listener = threading.Thread(target = bot.wait_for_challenges, daemon = True)
+        listener.start()
+        while not mock.listening(user):
+            time.sleep(0.01)
+
+        start = time.monotonic()
+        for opponent in opponents:
+            mock.challenge_from(opponent, user, seconds, inc)
+            if rate:
+                time.sleep(1 / rate)
+
+        deadline = start + (timeout or 2 * seconds + maxPlies * think + 60)
+        nextDrop = start + dropEvery if dropEvery else None
+        while sum(mock.finished.values()) + sum(mock.declined.values()) < games and \
+              time.monotonic() < deadline:
+            time.sleep(0.05)
+            if nextDrop and time.monotonic() > nextDrop:
+                mock.disconnect()
+                nextDrop += dropEvery
+
+        report = mock.report(time.monotonic() - start)
+        report['requested'] = games
+        report['limiter'] = bot.limiter.stats()
+        if metrics:
+            report['bot'] = bot.metrics.snapshot()
+        mock.close()
+        bot.close()
+        listener.join(timeout = 5)
+
+    return report
+
+
+def load_selector(name):
+    '''
+      Input:
+           name (string: 'module:function', e.g. 'chamberi:weak_engine', or
+                 'module:function()' for a function building the moveSelector,
+                 e.g. 'simpleEngine:selector()')
+
+      Output:
+           the moveSelector
+    '''
+    (module, function) = name.split(':')
+    if function.endswith('()'):
+        return getattr(importlib.import_module(module), function[:-2])()
+    return getattr(importlib.import_module(module), function)
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description = 'Mock Lichess server and BOT load test.')
+    parser.add_argument('--games', type = int, default = 100, help = 'number of games of the load test')
+    parser.add_argument('--clock', type = float, default = 60, help = 'initial clock, in seconds')
+    parser.add_argument('--increment', type = int, default = 0, help = 'clock increment, in seconds')
+    parser.add_argument('--think', type = float, default = 0.1, help = 'average seconds per opponent move')
+    parser.add_argument('--rate', type = float, help = 'challenges per second (default: all at once)')
+    parser.add_argument('--plies', type = int, default = 120, help = 'games reaching this length are drawn')
+    parser.add_argument('--timeout', type = float, help = 'seconds before giving up on unfinished games')
+    parser.add_argument('--selector', help = 'moveSelector to test, as module:function (default: random moves)')
+    parser.add_argument('--output', '-o', help = 'JSON file where the report is written')
+    parser.add_argument('--max-games', type = int, help = 'games the BOT plays at once (default: all of them)')
+    parser.add_argument('--drop-every', type = float, help = 'seconds between simulated drops of all the streams')
+    parser.add_argument('--server-rate', type = float, nargs = 2, metavar = ('RATE', 'BURST'),
+                        help = 'requests per second (and burst) the server allows the BOT')
+    parser.add_argument('--bot-rate', type = float, nargs = 2, metavar = ('RATE', 'BURST'),
+                        help = 'requests per second (and burst) of the BOT rate limiter')
+    parser.add_argument('--penalty', type = float, default = 60, help = 'seconds of 429s over the server rate')
+    parser.add_argument('--verbose', '-v', action = 'store_true', help = 'show the output of the BOT')
+    parser.add_argument('--metrics', action = 'store_true', help = 'include the per-stage timings of the BOT')
+    parser.add_argument('--serve', action = 'store_true', help = 'only serve, until interrupted')
+    parser.add_argument('--port', type = int, default = 8080, help = 'port to serve at, with --serve')
+    parser.add_argument('--bot', action = 'append', default = [], help = 'NAME:TOKEN account, with --serve')
+    parser.add_argument('--opponents', type = int, default = 10, help = 'scripted opponents, with --serve')
+    args = parser.parse_args()
+
+    if args.serve:
+        mock = MockLichess(port = args.port, maxPlies = args.plies)
+        for account in args.bot:
+            mock.register(*account.split(':', 1))
+        for i in range(1, args.opponents + 1):
+            mock.add_opponent(Opponent('Opponent%d' % i, think = args.think, seed = i))
+        mock.start()
+        print("Serving at", mock.url, flush = True)
+
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            mock.close()
+
+    else:
+        selector = load_selector(args.selector) if args.selector else random_mover
+        report = load_test(selector, games = args.games, seconds = args.clock, inc = args.increment,
+                           think = args.think, rate = args.rate, maxPlies = args.plies,
+                           timeout = args.timeout, verbose = args.verbose, metrics = args.metrics,
+                           maxGames = args.max_games, dropEvery = args.drop_every,
+                           serverRate = args.server_rate, penalty = args.penalty,
+                           botRate = args.bot_rate)
+
+        if args.output:
+            with open(args.output, 'w') as f:
+                json.dump(report, f, indent = 2)
+        json.dump(report, sys.stdout, indent = 2)
+        print()
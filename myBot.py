@@ -1,33 +1,284 @@
 #!/usr/bin/env python3
 
 import requests
+import requests.adapters
 import json
 import time
+import random
 
 import threading
+import collections
+import concurrent.futures
+
+# Must install python-chess for the following:
+import chess
+
+import botMetrics
+import admission
+import outbox
+import rateLimit
+
+
+def board_selector(selector):
+    '''
+      Mark a moveSelector as taking the live board of the game (chess.Board type)
+      instead of the string list of game moves. The selector must leave the board
+      as it found it (push/pop are fine).
+        Input:
+             selector (function (board, clockSeconds, oppSeconds) -> (move, msg))
+
+        Output:
+             the same selector
+    '''
+    selector.takesBoard = True
+    return selector
+
+def session_selector(selector):
+    '''
+      Mark a moveSelector as taking the live board and the GameSession of the
+      game, where it keeps its per-game state instead of in module globals.
+        Input:
+             selector (function (board, clockSeconds, oppSeconds, session) -> (move, msg))
+
+        Output:
+             the same selector
+    '''
+    selector.takesBoard = True
+    selector.takesSession = True
+    return selector
+
+# Earliest time (time.monotonic()) to send the move being picked in this thread
+DELAY = threading.local()
+
+
+def delay_move(seconds):
+    '''
+      Ask the Bot to send the move that the selector is picking (in this
+      thread) no sooner than 'seconds' from now, e.g. for a humanlike pause.
+      The selector returns at once and the Bot sends the move with a timer,
+      so the game thread, the workers and the engine are free meanwhile.
+        Input:
+             seconds (delay since the call)
+    '''
+    DELAY.notBefore = max(getattr(DELAY, 'notBefore', 0), time.monotonic() + seconds)
+
+def backoff(attempt, base = 1, cap = 60):
+    '''
+      Seconds to wait before reconnecting: exponential in the number of failed
+      attempts, with full jitter so that many games do not retry in lockstep.
+        Input:
+             attempt (int: attempts that already failed, from 0)
+                base (optional, seconds of the first wait, at most)
+                 cap (optional, maximum wait in seconds)
+    '''
+    return random.uniform(0, min(cap, base * 2**attempt))
+
+
+class GameSession(object):
+    '''
+      State kept along a game by the Bot playing it, and handed to the
+      selectors decorated with 'session_selector'. It is released when the
+      game ends, so concurrent games never share mutable state.
+        Selectors may use:
+                   board (chess.Board type: live board of the game, kept up to date)
+                   state (dictionary: per-game state of the selector)
+                  engine (engine handle of the game, e.g. a SimpleEngine; closed with
+                          the session if it has a 'close' method)
+                   cache (dictionary: per-game caches of the selector)
+    '''
+
+    __slots__ = ('id', 'board', 'moves', 'movesStr', 'botIsWhite', 'sentMessages',
+                 'received', 'moveSent', 'pendingPly', 'timer', 'state', 'engine', 'cache')
+
+    def __init__(self, gameID):
+        self.id = gameID
+        self.board = chess.Board()
+        self.moves = []
+        self.movesStr = ''
+        self.botIsWhite = None
+        self.sentMessages = set()
+        self.received = None
+        self.moveSent = None
+        self.pendingPly = None
+        self.timer = None
+        self.state = {}
+        self.engine = None
+        self.cache = {}
+
+    def close(self):
+        '''
+          Release what the game holds: the pending move, the engine and the caches.
+        '''
+        if self.timer:
+            self.timer.cancel()
+            self.timer = None
+
+        engine, self.engine = self.engine, None
+        if hasattr(engine, 'close'):
+            try:
+                engine.close()
+            except Exception as e:
+                print(e)
+
+        self.state.clear()
+        self.cache.clear()
+
 
 class Bot(object):
 
-    def __init__(self, name, token, moveSelector, addTimeMessage):
+    def __init__(self, name, token, moveSelector, addTimeMessage,
+                 poolSize = 32, timeout = 10, api = 'https://lichess.org/api/', metrics = None,
+                 admissionControl = None, rateLimiter = None):
         '''
           Bot object creator.
             Input:
                       name (string: BOT name)
                      token (string: AUTH2 token)
              moveoSelector (function that takes a string list of game moves (UCI format)
-                            and outputs a possible next move (UCI format))
+                            and outputs a possible next move (UCI format), or the live
+                            board of the game if decorated with 'board_selector', and
+                            also its GameSession with 'session_selector')
              chatMessenger (function that takes a string list of game moves (UCI format)
                             and outputs a string (chat text to be sent))
+                  poolSize (optional, maximum number of keep-alive connections to lichess)
+                   timeout (optional, default timeout in seconds of every API call)
+                       api (optional, root URL of the API, e.g. the one of a
+                            mockLichess server for load tests)
+                   metrics (optional, botMetrics.Metrics type: time every stage of
+                            the moves and count HTTP errors, cache hits...)
+          admissionControl (optional, admission.AdmissionControl type: how many games
+                            to play at once, and which challenges to prefer)
+               rateLimiter (optional, rateLimit.RateLimiter type; by default the one
+                            shared by all the BOT objects of the account)
         '''
 
         self.name  = name
         self.token = token
-        self.api   = 'https://lichess.org/api/'
+        self.api   = api if api.endswith('/') else api + '/'
         self.auth  = { 'Authorization': 'Bearer ' + token }
 
         self.moveSelector  = moveSelector
         self.addTimeMessage = addTimeMessage
 
+        # A single pooled session shared by all the game threads, so that every
+        # call reuses an open TLS connection instead of doing a new handshake
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.session.headers.update(self.auth)
+        adapter = requests.adapters.HTTPAdapter(pool_connections = 1, pool_maxsize = poolSize)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+        self.metrics = metrics if metrics is not None else botMetrics.DISABLED
+        self.admission = admissionControl or admission.AdmissionControl()
+        self.limiter = rateLimiter or rateLimit.shared(token)
+
+        # Chat lines and add-time requests, sent in the background
+        self.outbox = outbox.Outbox(self.post, metrics = self.metrics)
+
+        # A single reader of the event stream, resolving the futures of the
+        # challenges we are waiting for (see 'expect')
+        self.reader = None
+        self.readerLock = threading.Lock()
+        self.connected = threading.Event()
+        self.closing = threading.Event()
+        self.acceptChallenges = False
+        self.waiters = {}
+        self.outcomes = collections.OrderedDict()
+        self.waitersLock = threading.Lock()
+
+        # Registry of the games being played: exactly one runner per game
+        # (and none for the games known to be over)
+        self.runners = {}
+        self.ended = collections.OrderedDict()
+        self.runnersLock = threading.Lock()
+
+
+    def request(self, method, endpoint, **kwargs):
+        '''
+          Send a request through the rate limiter (see rateLimit), counting it.
+            Input:
+                  method (string: 'GET' or 'POST')
+                endpoint (string: path relative to the API root)
+                  kwargs (passed to requests.Session.request)
+
+            Output:
+                response (requests.Response type)
+        '''
+        label = rateLimit.label(endpoint)
+        priority = rateLimit.priority(label)
+        waited = self.limiter.acquire(priority)
+
+        try:
+            ans = self.session.request(method, self.api + endpoint, **kwargs)
+        except requests.RequestException:
+            self.limiter.record(label, priority, waited = waited)
+            self.metrics.count('httpErrors')
+            raise
+
+        self.limiter.record(label, priority, ans.status_code, ans.headers.get('Retry-After'), waited)
+        if ans.status_code >= 400:
+            self.metrics.count('httpErrors')
+            self.metrics.count('httpStatus/%d' % ans.status_code)
+        return ans
+
+
+    def post(self, endpoint, data = None, timeout = None, retries = None):
+        '''
+          Send a POST request to the API through the pooled session.
+            Input:
+                endpoint (string: path relative to the API root)
+                    data (optional, dictionary with the form parameters)
+                 timeout (optional, seconds before giving up, defaults to self.timeout)
+                 retries (optional, times to send it again after a 429, once the
+                          rate limiter lets it go; by default moves and game control
+                          requests are retried, the others are not)
+
+            Output:
+                response (requests.Response type)
+        '''
+        if retries is None:
+            retries = 2 if rateLimit.priority(rateLimit.label(endpoint)) < rateLimit.BACKGROUND else 0
+
+        while True:
+            ans = self.request('POST', endpoint, data = data, timeout = timeout or self.timeout)
+            if ans.status_code != 429 or retries <= 0:
+                return ans
+            retries -= 1
+
+
+    def stream(self, endpoint):
+        '''
+          Open an ndjson stream through the pooled session.
+          Only the connection is bounded by the timeout, since streams stay
+          silent for long periods.
+            Input:
+                endpoint (string: path relative to the API root)
+
+            Output:
+                response (streamed requests.Response type, use it as a context manager)
+
+            Raises requests.HTTPError if Lichess refuses the stream (e.g. a 429, already
+            recorded by the rate limiter), so that callers reconnect with backoff
+            instead of reading the error body as events.
+        '''
+        ans = self.request('GET', endpoint, stream = True, timeout = (self.timeout, None))
+        if not ans.ok:
+            ans.close()
+            raise requests.HTTPError('%d opening %s' % (ans.status_code, endpoint), response = ans)
+        return ans
+
+
+    def close(self):
+        '''
+          Stop reading the event stream, send what is left in the outbox, then
+          release the pooled connections and the metrics endpoint, if any.
+        '''
+        self.closing.set()
+        self.outbox.close()
+        self.session.close()
+        self.metrics.close()
+
 
     def __str__(self):
         return "BOT %s with AUTH TOKEN %s" % (self.name, self.token[:3] + "..." + self.token[-3:])
@@ -45,9 +296,12 @@ class Bot(object):
             Output:
                    gameID (challenge identifier, which will be the game identifier if accepted)
         '''
+        # Read the event stream before challenging, not to miss the answer
+        self.listen()
+
         params = { 'rated': str(rated).lower(), 'clock.limit': seconds,
                    'clock.increment': inc }
-        ans = requests.post(self.api + 'challenge/' + username, headers = self.auth, data = params)
+        ans = self.post('challenge/' + username, data = params)
         info = json.loads(ans.text)
         return info['challenge']['id']
 
@@ -58,7 +312,7 @@ class Bot(object):
             Input:
                  gameID (challenge identifier)
         '''
-        requests.post(self.api + 'challenge/' + gameID + '/cancel', headers = self.auth)
+        self.post('challenge/' + gameID + '/cancel')
 
 
     def accept_challenge(self, gameID):
@@ -66,8 +320,21 @@ class Bot(object):
           Accept a challenge.
             Input:
                  gameID (challenge identifier)
+
+            Output:
+                Boolean (true) if Lichess accepted it (it may have been canceled)
+        '''
+        return self.post('challenge/' + gameID + '/accept').ok
+
+
+    def decline_challenge(self, gameID, reason = None):
+        '''
+          Decline a challenge.
+            Input:
+                 gameID (challenge identifier)
+                 reason (optional, Lichess decline reason, e.g. 'later' or 'tooSlow')
         '''
-        requests.post(self.api + 'challenge/' + gameID + '/accept', headers = self.auth)
+        self.post('challenge/' + gameID + '/decline', data = { 'reason' : reason } if reason else None)
 
 
     def resign_game(self, gameID):
@@ -76,7 +343,7 @@ class Bot(object):
             Input:
                  gameID (game identifier)
         '''
-        requests.post(self.api + 'bot/game/' + gameID + '/resign', headers = self.auth)
+        self.post('bot/game/' + gameID + '/resign')
 
 
     def abort_game(self, gameID):
@@ -85,60 +352,203 @@ class Bot(object):
             Input:
                  gameID (game identifier)
         '''
-        requests.post(self.api + 'bot/game/' + gameID + '/abort', headers = self.auth)
+        self.post('bot/game/' + gameID + '/abort')
 
 
     def add_time(self, gameID, seconds):
         '''
-          Add time to the opponent clock.
+          Add time to the opponent clock (queued in the outbox, so it returns at once).
             Input:
                  gameID (game identifier)
                 seconds (int: seconds to be add)
         '''
-        requests.post(self.api + 'round/' + gameID + '/add-time/' + str(seconds), headers = self.auth)
+        self.outbox.send((gameID, 'add-time'), 'round/' + gameID + '/add-time/' + str(seconds))
 
 
-    def wait_for_starting_game(self, gameID):
+    def wait_for_starting_game(self, gameID, timeout = 30):
         '''
           Execute this after having sent a challenge has been created with 'challenge_user'.
+          If the challenge is not answered in time, cancel it.
             Input:
                  gameID (resulting from the challenge_user call).
+                timeout (optional, seconds to wait for the answer)
 
             Output:
-                Boolean (true) if the challenge was accepted, (false) if it was aborted
+                Boolean (true) if the challenge was accepted, (false) if it was declined,
+                canceled or not answered in time
         '''
-        s = requests.Session()
-        with s.get(self.api + 'stream/event', headers = self.auth, stream = True) as ans:
+        future = self.expect(gameID)
 
-            counter = 0
-            for line in ans.iter_lines():
+        try:
+            return future.result(timeout)
+
+        except concurrent.futures.TimeoutError:
+            if self.forget(gameID):
+                self.cancel_challenge(gameID)
+                return False
+            return future.result()
+
+
+    def challenge_users(self, usernames, rated = False, seconds = 180, inc = 0, timeout = 30, workers = 8):
+        '''
+          Challenge several users at once, playing every game as soon as its
+          challenge is accepted.
+            Input:
+                usernames (list of names of the users to be challenged)
+                    rated, seconds, inc (as in 'challenge_user')
+                  timeout (optional, seconds to wait for the answers, after which
+                           the pending challenges are canceled)
+                  workers (optional, challenges sent at the same time)
+
+            Output:
+                dictionary (username -> game identifier, or None if it was not accepted)
+        '''
+        self.listen()
+
+        def challenge(username):
+            try:
+                gameID = self.challenge_user(username, rated = rated, seconds = seconds, inc = inc)
+            except Exception as e:
+                print(e)
+                return (None, None)
 
-                # If the challenge has not been accepted after 3 cycles, cancel it
-                counter += 1
-                if counter >= 3:
-                    self.cancel_challenge(gameID)
-                    s.close()
-                    return False
+            future = self.expect(gameID)
+            future.add_done_callback(lambda f: f.cancelled() or not f.result() or self.game_started(gameID))
+            return (gameID, future)
 
-                if line:
-                    info = json.loads(line)
+        with concurrent.futures.ThreadPoolExecutor(max_workers = max(1, min(workers, len(usernames)))) as pool:
+            challenges = list(pool.map(challenge, usernames))
 
-                if info.get('type') == 'gameStart' and info.get('game').get('id') == gameID:
-                    s.close()
-                    return True
+        concurrent.futures.wait([f for (gameID, f) in challenges if f], timeout = timeout)
 
-                elif info.get('type') == 'challengeDeclined' and \
-                     info.get('challenge').get('id') == gameID:
-                    s.close()
-                    return False
+        output = {}
+        for (username, (gameID, future)) in zip(usernames, challenges):
+            if gameID and self.forget(gameID):
+                self.cancel_challenge(gameID)
+            accepted = future and not future.cancelled() and future.result()
+            output[username] = gameID if accepted else None
+
+        return output
+
+
+    def game_started(self, gameID):
+        '''
+          Play a game started by one of our challenges, in the background.
+            Input:
+                    gameID (game identifier)
+        '''
+        self.admission.started(gameID)
+        self.start_game(gameID)
+
+
+    def expect(self, challengeID):
+        '''
+          Wait for the answer to a challenge, from the shared event stream.
+            Input:
+                 challengeID (challenge identifier)
+
+            Output:
+                 concurrent.futures.Future type, resolved to True when the game
+                 starts and to False if the challenge is declined or canceled
+        '''
+        with self.waitersLock:
+            future = self.waiters.get(challengeID)
+            if future is None:
+                future = concurrent.futures.Future()
+                if challengeID in self.outcomes:
+                    future.set_result(self.outcomes.pop(challengeID))
+                else:
+                    self.waiters[challengeID] = future
+            return future
+
+
+    def forget(self, challengeID):
+        '''
+          Stop waiting for the answer to a challenge.
+            Output:
+                 Boolean (true) if it had not been answered yet
+        '''
+        with self.waitersLock:
+            future = self.waiters.pop(challengeID, None)
+            return future is not None and future.cancel()
+
+
+    def dispatch(self, info):
+        '''
+          Process one event of the 'stream/event' stream: answer the challenges
+          we are waiting for and, if we are waiting for challenges, handle it.
+            Input:
+                      info (dictionary: parsed line of the event stream)
+        '''
+        kind = info.get('type')
+
+        if kind in ('gameStart', 'challengeDeclined', 'challengeCanceled'):
+            challengeID = info.get('game' if kind == 'gameStart' else 'challenge').get('id')
+            with self.waitersLock:
+                future = self.waiters.pop(challengeID, None)
+                if future is None:
+                    # Answered before anybody waits for it: keep it for a while
+                    self.outcomes[challengeID] = kind == 'gameStart'
+                    if len(self.outcomes) > 256:
+                        self.outcomes.popitem(last = False)
+                elif not future.done():
+                    future.set_result(kind == 'gameStart')
+
+        if self.acceptChallenges:
+            print(info, flush = True)
+            self.event(info)
+
+
+    def listen(self):
+        '''
+          Start reading the event stream in the background, if nobody does,
+          and wait (at most the API timeout) until it is connected.
+        '''
+        with self.readerLock:
+            if self.reader is None:
+                self.reader = threading.Thread(target = self.read_events, daemon = True)
+                self.reader.start()
+
+        self.connected.wait(self.timeout)
+
+
+    def read_events(self):
+        '''
+          Read the event stream until the BOT is closed, reconnecting when it
+          drops (with backoff). On every connection Lichess sends again the
+          games in progress, so games whose runner was lost are resumed.
+        '''
+        attempt = 0
+
+        while not self.closing.is_set():
+
+            connectedAt = None
+            try:
+                with self.stream('stream/event') as ans:
+                    self.connected.set()
+                    connectedAt = time.monotonic()
 
-        s.close()
-        return False
+                    for line in ans.iter_lines():
+                        if line:
+                            self.dispatch(json.loads(line))
+
+            except Exception as e:
+                print(e)
+
+            self.connected.clear()
+
+            # A connection that lasted a while was not a failed attempt
+            if connectedAt and time.monotonic() - connectedAt > 60:
+                attempt = 0
+
+            self.metrics.count('eventReconnects')
+            self.closing.wait(backoff(attempt))
+            attempt += 1
 
 
     def write_in_chat(self, gameID, msg):
         '''
-          Write text in the chat.
+          Write text in the chat (queued in the outbox, so it returns at once).
             Input:
                 gameID (game identifier)
                    msg (string: text to be sent / None)
@@ -146,124 +556,388 @@ class Bot(object):
         if msg:
             for room in ['player', 'spectator']:
                 params = { 'room' : room, 'text' : msg }
-                requests.post(self.api + 'bot/game/' + gameID + '/chat', headers = self.auth, data = params)
+                self.outbox.send((gameID, 'chat', room, msg), 'bot/game/' + gameID + '/chat', data = params)
 
 
-    def play_game(self, gameID):
+    def new_game(self, gameID):
         '''
-          Play a game which has started.
+          Create the state kept along a game.
             Input:
                     gameID (game identifier)
+
+            Output:
+                GameSession type (to be passed to 'game_event', and closed when
+                the game ends)
         '''
-        s = requests.Session()
+        return GameSession(gameID)
 
-        sentMessages = []
 
-        with s.get(self.api + 'bot/game/stream/' + gameID, headers = self.auth, stream = True) as ans:
+    def sync_board(self, game, movesStr):
+        '''
+          Bring the board of a game up to date, pushing only the new moves.
+            Input:
+                      game (GameSession type, created by 'new_game')
+                  movesStr (string: all the game moves in UCI format, space separated)
+        '''
+        board, moves, previous = game.board, game.moves, game.movesStr
 
-            for line in ans.iter_lines():
-                if line:
-                    print(line, flush = True)
-                    info = json.loads(line)
-                    state = info.get('state')
+        if not movesStr.startswith(previous) or \
+           (len(movesStr) > len(previous) and previous and movesStr[len(previous)] != ' '):
+            # Not a continuation (e.g. a takeback), replay the game from the start
+            board.reset()
+            del moves[:]
+            previous = ''
 
-                    # Check if we got a message from the chat and continue in that case
-                    if info.get('type') == 'chatLine':
-                        continue
+        for move in movesStr[len(previous):].split():
+            board.push_uci(move)
+            moves.append(move)
 
-                    if state:
-                        # Get the color our BOT is playing with
-                        botIsWhite = info.get('white').get('id') == self.name.lower()
+        game.movesStr = movesStr
 
-                        # Check if we need to abort the game cause the opponent did not move
-                        if time.time() * 1000 - info.get('createdAt') > 60 * 1000: # 1 minute
-                            self.abort_game(gameID)
 
-                    else:
-                        state = info
+    def game_event(self, game, info):
+        '''
+          Process one event of a game stream: pick and send a move if it is our turn.
+            Input:
+                      game (GameSession type, created by 'new_game')
+                      info (dictionary: parsed line of the game stream)
 
-                    # If the game is finished, terminate
-                    if state.get('status') != 'started':
-                        s.close()
-                        return
+            Output:
+                   Boolean (false) if the game is over, (true) otherwise
+        '''
+        gameID = game.id
+        state = info.get('state')
+
+        # Time spent since the line was read (parsing, waiting for a worker)
+        metrics = self.metrics
+        botMetrics.activate(metrics)
+        received, game.received = game.received, None
+        if metrics and received:
+            metrics.observe('stream', time.perf_counter() - received)
+
+        # Check if we got a message from the chat and continue in that case
+        if info.get('type') == 'chatLine':
+            return True
+
+        if state:
+            # Get the color our BOT is playing with
+            game.botIsWhite = info.get('white').get('id') == self.name.lower()
+
+            # Check if we need to abort the game cause the opponent did not move
+            # (not when resuming a game that is under way)
+            if time.time() * 1000 - info.get('createdAt') > 60 * 1000 and \
+               len(state.get('moves', '').split()) < 2: # 1 minute
+                self.abort_game(gameID)
+
+        else:
+            state = info
+
+        botIsWhite = game.botIsWhite
+
+        # If the game is finished, terminate
+        if state.get('status') != 'started':
+            metrics.count('gamesFinished')
+            return False
+
+        with metrics.span('sync'):
+            self.sync_board(game, state.get('moves', ''))
+        board = game.board
+
+        # Continue the loop if it is not the BOT's turn
+        if board.turn != botIsWhite:
+            return True
+
+        # The move for this position is already picked, waiting for its time
+        ply = len(board.move_stack)
+        if game.pendingPly == ply:
+            return True
+
+        # Time the opponent (and the stream) took since our previous move
+        if metrics and game.moveSent and received:
+            metrics.observe('wait', received - game.moveSent)
+
+        # Pick a move using the moveSelector, giving it either the live board
+        # or (for older selectors) the list of moves
+        clockMS = state.get('wtime') if botIsWhite else state.get('btime')
+        opponentMS = state.get('btime') if botIsWhite else state.get('wtime')
+        position = board if getattr(self.moveSelector, 'takesBoard', False) else game.moves
+        extra = [game] if getattr(self.moveSelector, 'takesSession', False) else []
+        DELAY.notBefore = 0
+        with metrics.span('selector'):
+            m, msg = self.moveSelector(position, clockMS / 1000, opponentMS / 1000, *extra)
+
+        # If the selector asked for a delay (see 'delay_move'), send the move
+        # later from a timer and keep reading the stream meanwhile
+        delay = DELAY.notBefore - time.monotonic()
+        if delay > 0:
+            metrics.count('delayedMoves')
+            game.pendingPly = ply
+            self.schedule_move(game, delay, [game, m, msg, clockMS, opponentMS, received])
+            return True
+
+        return self.send_move(game, m, msg, clockMS, opponentMS, received)
+
+
+    def schedule_move(self, game, delay, args):
+        '''
+          Call 'send_delayed' with 'args' after 'delay' seconds, from a timer
+          thread (kept in game.timer, so that closing the game cancels it).
+        '''
+        game.timer = threading.Timer(delay, self.send_delayed, args)
+        game.timer.daemon = True
+        game.timer.start()
 
-                    movesStr = state.get('moves', '')
-                    moves = [] if len(movesStr) == 0 else movesStr.split(' ')
 
-                    # Continue the loop if it is not the BOT's turn
-                    if (1 if botIsWhite else 0) == len(moves) % 2:
-                        continue
+    def send_delayed(self, game, *args):
+        '''
+          Send a delayed move (see 'send_move'). If it fails, the next event
+          of the game picks the move again.
+        '''
+        try:
+            self.send_move(game, *args)
+        except Exception as e:
+            print(e)
+            self.metrics.count('delayedMoveErrors')
 
-                    # Pick a move using the moveSelector
-                    clockMS = state.get('wtime') if botIsWhite else state.get('btime')
-                    opponentMS = state.get('btime') if botIsWhite else state.get('wtime')
-                    m, msg = self.moveSelector(moves, clockMS / 1000, opponentMS / 1000)
 
-                    # Possibly write in the chat
-                    if not msg in sentMessages:
-                        sentMessages.append(msg)
-                        self.write_in_chat(gameID, msg)
+    def send_move(self, game, m, msg, clockMS, opponentMS, received = None):
+        '''
+          Send the move picked by the moveSelector, and the chat and add-time
+          requests that go with it.
+            Input:
+                      game (GameSession type, created by 'new_game')
+                         m (string: move in UCI format, or 'resign')
+                       msg (string: message for the chat, or None)
+                   clockMS (milliseconds left on our clock)
+                opponentMS (milliseconds left on the opponent's clock)
+                  received (optional, time.perf_counter() when the event was read)
 
-                    if m == 'resign':
-                        self.resign_game(gameID)
-                        s.close()
-                        return
+            Output:
+                   Boolean (false) if the BOT resigned, (true) otherwise
+        '''
+        gameID = game.id
+        sentMessages = game.sentMessages
+        metrics = self.metrics
 
-                    if (opponentMS / 1000 < 15) and (clockMS / 1000 > 30):
-                        self.add_time(gameID, 10)
-                        if not self.addTimeMessage in sentMessages:
-                            sentMessages.append(self.addTimeMessage)
-                            self.write_in_chat(gameID, self.addTimeMessage)
+        # The move (or the resignation) goes first, then the chat and add-time
+        # requests are queued for the background outbox
+        try:
+            if m == 'resign':
+                metrics.count('resigns')
+                self.resign_game(gameID)
 
-                    requests.post(self.api + 'bot/game/' + gameID + '/move/' + m, headers = self.auth)
+            else:
+                with metrics.span('move'):
+                    self.post('bot/game/' + gameID + '/move/' + m)
 
-        s.close()
+        finally:
+            # Sent or failed, the position no longer waits for a delayed move
+            game.pendingPly = None
 
+        if metrics and m != 'resign':
+            game.moveSent = time.perf_counter()
+            metrics.count('moves')
+            if received:
+                metrics.observe('turn', game.moveSent - received)
 
-    def wait_for_challenges(self):
+        # Possibly write in the chat
+        if not msg in sentMessages:
+            sentMessages.add(msg)
+            self.write_in_chat(gameID, msg)
+
+        if m == 'resign':
+            return False
+
+        if (opponentMS / 1000 < 15) and (clockMS / 1000 > 30):
+            self.add_time(gameID, 10)
+            if not self.addTimeMessage in sentMessages:
+                sentMessages.add(self.addTimeMessage)
+                self.write_in_chat(gameID, self.addTimeMessage)
+
+        return True
+
+
+    def claim(self, gameID, runner = None):
         '''
-          Continuously wait for challenges.
-          When a challenge comes, accept it, play the game and continue.
+          Register the runner of a game, counting it as live for admission
+          control (the runner frees it with 'game_over' when it ends).
+            Input:
+                    gameID (game identifier)
+                    runner (optional, e.g. the thread playing it)
+
+            Output:
+                Boolean (false) if the game already has a runner, or is over
+        '''
+        with self.runnersLock:
+            if gameID in self.runners or gameID in self.ended:
+                return False
+            self.runners[gameID] = runner
+
+        self.admission.started(gameID)
+        return True
+
+
+    def release(self, gameID, over = True):
+        '''
+          Unregister the runner of a game.
+            Input:
+                    gameID (game identifier)
+                      over (optional, Boolean (false) if the runner gave up but the
+                            game may go on, so that it can be resumed)
+        '''
+        with self.runnersLock:
+            self.runners.pop(gameID, None)
+            if over:
+                self.ended[gameID] = True
+                if len(self.ended) > 1024:
+                    self.ended.popitem(last = False)
+
+
+    def play_game(self, gameID, maxReconnects = 5, claimed = False):
+        '''
+          Play a game which has started, unless it is already being played.
+          If the game stream drops, reconnect (with backoff) and resume from
+          the state Lichess sends again.
+            Input:
+                    gameID (game identifier)
+             maxReconnects (optional, reconnections in a row before giving up)
+                   claimed (optional, the caller already registered the runner)
         '''
+        if not claimed and not self.claim(gameID, threading.current_thread()):
+            return
+
+        game = self.new_game(gameID)
+        self.metrics.count('games')
+        attempt = 0
+        over = False
 
         try:
-            s = requests.Session()
-            with s.get(self.api + 'stream/event', headers = self.auth, stream = True) as ans:
+            while not self.closing.is_set():
+
+                try:
+                    with self.stream('bot/game/stream/' + gameID) as ans:
 
-                for line in ans.iter_lines():
-                    if line:
-                        info = json.loads(line)
-                        print(info, flush = True)
+                        for line in ans.iter_lines():
+                            if line:
+                                attempt = 0
+                                print(line, flush = True)
+                                if self.metrics:
+                                    game.received = time.perf_counter()
+                                if not self.game_event(game, json.loads(line)):
+                                    over = True
+                                    return
 
-                        if info.get('type') == 'challenge':
+                except Exception as e:
+                    print(e)
 
-                            gameID = info.get('challenge').get('id')
+                if attempt >= maxReconnects:
+                    return
 
-                            if info.get('challenge').get('variant').get('key') != 'standard':
-                                continue
+                self.metrics.count('gameReconnects')
+                self.closing.wait(backoff(attempt))
+                attempt += 1
 
-                            if info.get('challenge').get('speed') == 'correspondence':
-                                continue
+        finally:
+            game.close()
+            self.release(gameID, over)
+            self.game_over(gameID)
+
+
+    def game_over(self, gameID):
+        '''
+          Free the game for admission control, accepting the queued challenges
+          that now fit.
+            Input:
+                    gameID (game identifier)
+        '''
+        for challenge in self.admission.finish(gameID):
+            self.admit(challenge['id'])
 
-                            self.accept_challenge(gameID)
 
-                            thr = threading.Thread(target = self.play_game, args=[gameID])
-                            thr.start()
+    def admit(self, gameID):
+        '''
+          Accept a challenge already admitted by admission control and play it.
+            Input:
+                    gameID (challenge identifier)
+        '''
+        if self.accept_challenge(gameID):
+            self.metrics.count('challengesAccepted')
+            self.start_game(gameID)
+        else:
+            self.game_over(gameID)
 
-                        if info.get('type') == 'gameStart':
 
-                            gameID = info.get('game').get('id')
+    def expire_challenge(self, gameID):
+        '''
+          Decline a challenge that waited too long for a free game.
+        '''
+        if self.admission.expire(gameID):
+            self.metrics.count('challengesDeclined')
+            self.decline_challenge(gameID, 'later')
 
-                            thr = threading.Thread(target = self.play_game, args=[gameID])
-                            thr.start()
 
-        except Exception as s:
-            print(s)
-            try:
-                s.close()
-            except Exception:
-                pass
+    def start_game(self, gameID):
+        '''
+          Play a game in the background, unless it is already being played.
+            Input:
+                    gameID (game identifier)
+        '''
+        thr = threading.Thread(target = self.play_game, args=[gameID], kwargs = { 'claimed' : True })
+        if self.claim(gameID, thr):
+            thr.start()
 
-            time.sleep(60)
-            self.wait_for_challenges()
 
+    def event(self, info):
+        '''
+          Process one event of the 'stream/event' stream: admit standard,
+          non-correspondence challenges (accepting, queueing or declining them)
+          and start the games.
+            Input:
+                      info (dictionary: parsed line of the event stream)
+        '''
+        if info.get('type') == 'challenge':
+
+            gameID = info.get('challenge').get('id')
+
+            if info.get('challenge').get('variant').get('key') != 'standard':
+                return
+
+            if info.get('challenge').get('speed') == 'correspondence':
+                return
+
+            (decision, reason) = self.admission.offer(info.get('challenge'))
+
+            if decision == admission.ACCEPT:
+                self.admit(gameID)
+
+            elif decision == admission.QUEUE:
+                self.metrics.count('challengesQueued')
+                timer = threading.Timer(self.admission.queueTimeout, self.expire_challenge, [gameID])
+                timer.daemon = True
+                timer.start()
+
+            else:
+                self.metrics.count('challengesDeclined')
+                self.decline_challenge(gameID, reason)
+
+        if info.get('type') == 'challengeCanceled':
+
+            self.admission.cancel(info.get('challenge').get('id'))
+
+        if info.get('type') == 'gameStart':
+
+            gameID = info.get('game').get('id')
+
+            # Counted as live only if it is started now (not for a late or
+            # replayed gameStart of a game already played)
+            self.start_game(gameID)
+
+
+    def wait_for_challenges(self):
+        '''
+          Continuously wait for challenges (until the BOT is closed).
+          When a challenge comes, accept it, play the game and continue.
+        '''
+        self.acceptChallenges = True
+        self.listen()
+        self.reader.join()
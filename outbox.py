@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+
+import time
+import threading
+import collections
+
+import botMetrics
+
+
+class Outbox(object):
+
+    def __init__(self, post, rate = 4, retries = 3, backoff = 1, maxAge = 30, metrics = None):
+        '''
+          Background sender of the requests that are not on the critical path
+          of a move (chat lines, add-time). They are sent in order by a single
+          thread, at most 'rate' per second; a request queued again before it
+          is sent replaces the pending one instead of being sent twice.
+            Input:
+                    post (function (endpoint, data) -> requests.Response, e.g. Bot.post)
+                    rate (optional, requests per second)
+                 retries (optional, attempts after a failed one, i.e. an exception,
+                          a 429 or a 5xx status)
+                 backoff (optional, seconds before the first retry, doubled at every one)
+                  maxAge (optional, seconds after which an unsent request is dropped)
+                 metrics (optional, botMetrics.Metrics type)
+        '''
+        self.post = post
+        self.interval = 1 / rate
+        self.retries = retries
+        self.backoff = backoff
+        self.maxAge = maxAge
+        self.metrics = metrics if metrics is not None else botMetrics.DISABLED
+
+        self.pending = collections.OrderedDict()  # key -> [endpoint, data, created, attempts, notBefore]
+        self.cond = threading.Condition()
+        self.nextSend = 0
+        self.closing = False
+        self.worker = None
+
+
+    def send(self, key, endpoint, data = None):
+        '''
+          Queue a request.
+            Input:
+                    key (hashable: requests with the same key are coalesced,
+                         e.g. (gameID, 'chat', room, text))
+               endpoint (string: path relative to the API root)
+                   data (optional, dictionary with the form parameters)
+        '''
+        with self.cond:
+            if self.worker is None:
+                self.worker = threading.Thread(target = self.run, daemon = True)
+                self.worker.start()
+
+            if key in self.pending:
+                self.pending[key][:2] = [endpoint, data]
+                self.metrics.count('outboxCoalesced')
+            else:
+                self.pending[key] = [endpoint, data, time.monotonic(), 0, 0]
+            self.cond.notify()
+
+
+    def next(self):
+        '''
+          Wait for the next request due (holding the lock).
+            Output:
+                 (key, entry), or None when closing with nothing left to send
+        '''
+        while True:
+            now = time.monotonic()
+
+            for (key, entry) in list(self.pending.items()):
+                if now - entry[2] > self.maxAge:
+                    del self.pending[key]
+                    self.metrics.count('outboxDropped')
+
+            if not self.pending:
+                if self.closing:
+                    return None
+                self.cond.wait()
+                continue
+
+            due = min(max(entry[4], self.nextSend) for entry in self.pending.values())
+            if due > now:
+                self.cond.wait(due - now)
+                continue
+
+            for (key, entry) in self.pending.items():
+                if entry[4] <= now:
+                    del self.pending[key]
+                    self.nextSend = now + self.interval
+                    return (key, entry)
+
+
+    def run(self):
+        while True:
+            with self.cond:
+                item = self.next()
+            if item is None:
+                return
+
+            (key, entry) = item
+            (endpoint, data, created, attempts, notBefore) = entry
+
+            try:
+                ans = self.post(endpoint, data = data)
+                failed = ans.status_code == 429 or ans.status_code >= 500
+            except Exception:
+                failed = True
+
+            if not failed:
+                self.metrics.count('outboxSent')
+
+            elif attempts < self.retries:
+                self.metrics.count('outboxRetries')
+                with self.cond:
+                    # A newer request with the same key supersedes the retry
+                    if key not in self.pending:
+                        self.pending[key] = [endpoint, data, created, attempts + 1,
+                                             time.monotonic() + self.backoff * 2**attempts]
+
+            else:
+                self.metrics.count('outboxDropped')
+
+
+    def close(self, timeout = 5):
+        '''
+          Stop, sending first what is pending for at most 'timeout' seconds.
+        '''
+        with self.cond:
+            self.closing = True
+            self.cond.notify()
+        if self.worker:
+            self.worker.join(timeout)
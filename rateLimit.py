@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+
+import time
+import threading
+import collections
+
+# Priorities of the API requests (lower goes first)
+MOVE       = 0   # move POSTs
+CONTROL    = 1   # accept/decline/cancel challenges, resign, abort, opening streams
+BACKGROUND = 2   # chat, add-time, sending challenges
+
+# Path segments of the API; any other one is an identifier (game, user, seconds...)
+WORDS = { 'api', 'bot', 'game', 'stream', 'event', 'move', 'chat', 'abort', 'resign', 'challenge',
+          'accept', 'decline', 'cancel', 'round', 'add-time', 'account' }
+
+
+def label(endpoint):
+    '''
+      Endpoint without identifiers, to count the requests of every kind.
+        Input:
+             endpoint (string: e.g. 'bot/game/abcd1234/move/e2e4')
+
+        Output:
+             string (e.g. 'bot/game/{}/move/{}')
+    '''
+    return '/'.join(s if s in WORDS else '{}' for s in endpoint.split('/'))
+
+
+def priority(label):
+    '''
+      Priority of the requests of an endpoint (given by 'label').
+    '''
+    if label == 'bot/game/{}/move/{}':
+        return MOVE
+    if label.endswith(('/chat', '/add-time/{}')) or label == 'challenge/{}':
+        return BACKGROUND
+    return CONTROL
+
+
+class RateLimiter(object):
+
+    def __init__(self, rate = 50, burst = 100, reserve = (0, 0.25, 0.5), penalty = 60):
+        '''
+          Token bucket shared by all the API requests of an account, serving
+          the most urgent requests first: a request waits while one of higher
+          priority is waiting, and lower priorities leave a part of the bucket
+          ('reserve') to the higher ones. After a 429 the requests of that
+          priority and below wait as long as Lichess asks, and the bucket is
+          emptied.
+            Input:
+                   rate (optional, requests per second in the long run)
+                  burst (optional, size of the bucket)
+                reserve (optional, fraction of the bucket that each priority leaves
+                         untouched: MOVE, CONTROL, BACKGROUND)
+                penalty (optional, seconds to wait after a 429 without Retry-After;
+                         Lichess asks for a full minute)
+        '''
+        self.rate = rate
+        self.burst = burst
+        self.reserve = [r * burst for r in reserve]
+        self.penalty = penalty
+
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.blocked = [0] * len(reserve)
+        self.waiting = [0] * len(reserve)
+        self.cond = threading.Condition()
+
+        self.counters = collections.defaultdict(collections.Counter)
+
+
+    def refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+
+    def acquire(self, priority):
+        '''
+          Wait until a request of this priority can be sent, and take its token.
+            Output:
+                 seconds waited
+        '''
+        start = time.monotonic()
+
+        with self.cond:
+            self.waiting[priority] += 1
+            try:
+                while True:
+                    now = time.monotonic()
+                    self.refill(now)
+
+                    if self.blocked[priority] > now:
+                        wait = self.blocked[priority] - now
+                    elif any(self.waiting[:priority]):
+                        wait = 1 / self.rate
+                    elif self.tokens < 1 + self.reserve[priority]:
+                        wait = (1 + self.reserve[priority] - self.tokens) / self.rate
+                    else:
+                        self.tokens -= 1
+                        self.cond.notify_all()
+                        return now - start
+
+                    self.cond.wait(wait)
+
+            finally:
+                self.waiting[priority] -= 1
+
+
+    def record(self, label, priority, status = None, retryAfter = None, waited = 0):
+        '''
+          Count a request and honour the backoff Lichess asks for.
+            Input:
+                     label (string: endpoint without identifiers, see 'label')
+                  priority (priority of the request)
+                    status (optional, HTTP status, or None if the request failed)
+                retryAfter (optional, value of the Retry-After header)
+                    waited (optional, seconds waited for the token)
+        '''
+        with self.cond:
+            counters = self.counters[label]
+            counters['requests'] += 1
+            counters['waitedMS'] += int(1000 * waited)
+
+            if status is None:
+                counters['errors'] += 1
+
+            elif status == 429:
+                counters['429'] += 1
+                try:
+                    seconds = float(retryAfter)
+                except (TypeError, ValueError):
+                    seconds = self.penalty
+
+                until = time.monotonic() + seconds
+                for p in range(priority, len(self.blocked)):
+                    self.blocked[p] = max(self.blocked[p], until)
+
+                # Start again at the sustained rate, not with a burst
+                self.tokens = min(self.tokens, 0)
+
+            elif status >= 400:
+                counters['errors'] += 1
+
+
+    def stats(self):
+        '''
+          Output:
+               dictionary (endpoint label -> counters of requests, 429s, errors
+               and milliseconds waited)
+        '''
+        with self.cond:
+            return { label : dict(c) for (label, c) in sorted(self.counters.items()) }
+
+
+# One limiter per account, shared by all its BOT objects in this process
+LIMITERS = {}
+LIMITERS_LOCK = threading.Lock()
+
+
+def shared(token, **kwargs):
+    '''
+      The RateLimiter of an account (created with kwargs the first time).
+        Input:
+             token (string: AUTH2 token of the account)
+    '''
+    with LIMITERS_LOCK:
+        if token not in LIMITERS:
+            LIMITERS[token] = RateLimiter(**kwargs)
+        return LIMITERS[token]
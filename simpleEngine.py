@@ -2,23 +2,247 @@
 
 import random
 import sys
+import os
+import time
+import array
+import threading
+import concurrent.futures
 
 import myBot
+import botMetrics
+import enginePool
+import compactBoard
 
 # Must install python-chess for the following:
 import chess
 import chess.engine
+import chess.polyglot
+
+# Only started if 'SimpleEngine.stockfish' is used, so that the engine runs
+# without Stockfish installed
+STOCKFISH = None
+
+# Piece values used to order captures (most valuable victim, least valuable attacker)
+ORDER_VALUES = { chess.PAWN : 100, chess.KNIGHT : 300, chess.BISHOP : 325,
+                 chess.ROOK : 500, chess.QUEEN : 910, chess.KING : 2000 }
+
+# Material values
+VALUES = { chess.PAWN : 100, chess.KNIGHT : 300, chess.BISHOP : 325,
+           chess.ROOK : 500, chess.QUEEN : 910, chess.KING : 0 }
+
+# Piece-square tables, from White's point of view (the first row is the 8th rank)
+PST = {
+    chess.PAWN : [
+          0,   0,   0,   0,   0,   0,   0,   0,
+         50,  50,  50,  50,  50,  50,  50,  50,
+         10,  10,  20,  30,  30,  20,  10,  10,
+          5,   5,  10,  25,  25,  10,   5,   5,
+          0,   0,   0,  20,  20,   0,   0,   0,
+          5,  -5, -10,   0,   0, -10,  -5,   5,
+          5,  10,  10, -20, -20,  10,  10,   5,
+          0,   0,   0,   0,   0,   0,   0,   0 ],
+    chess.KNIGHT : [
+        -50, -40, -30, -30, -30, -30, -40, -50,
+        -40, -20,   0,   0,   0,   0, -20, -40,
+        -30,   0,  10,  15,  15,  10,   0, -30,
+        -30,   5,  15,  20,  20,  15,   5, -30,
+        -30,   0,  15,  20,  20,  15,   0, -30,
+        -30,   5,  10,  15,  15,  10,   5, -30,
+        -40, -20,   0,   5,   5,   0, -20, -40,
+        -50, -40, -30, -30, -30, -30, -40, -50 ],
+    chess.BISHOP : [
+        -20, -10, -10, -10, -10, -10, -10, -20,
+        -10,   0,   0,   0,   0,   0,   0, -10,
+        -10,   0,   5,  10,  10,   5,   0, -10,
+        -10,   5,   5,  10,  10,   5,   5, -10,
+        -10,   0,  10,  10,  10,  10,   0, -10,
+        -10,  10,  10,  10,  10,  10,  10, -10,
+        -10,   5,   0,   0,   0,   0,   5, -10,
+        -20, -10, -10, -10, -10, -10, -10, -20 ],
+    chess.ROOK : [
+          0,   0,   0,   0,   0,   0,   0,   0,
+          5,  10,  10,  10,  10,  10,  10,   5,
+         -5,   0,   0,   0,   0,   0,   0,  -5,
+         -5,   0,   0,   0,   0,   0,   0,  -5,
+         -5,   0,   0,   0,   0,   0,   0,  -5,
+         -5,   0,   0,   0,   0,   0,   0,  -5,
+         -5,   0,   0,   0,   0,   0,   0,  -5,
+          0,   0,   0,   5,   5,   0,   0,   0 ],
+    chess.QUEEN : [
+        -20, -10, -10,  -5,  -5, -10, -10, -20,
+        -10,   0,   0,   0,   0,   0,   0, -10,
+        -10,   0,   5,   5,   5,   5,   0, -10,
+         -5,   0,   5,   5,   5,   5,   0,  -5,
+          0,   0,   5,   5,   5,   5,   0,  -5,
+        -10,   5,   5,   5,   5,   5,   0, -10,
+        -10,   0,   5,   0,   0,   0,   0, -10,
+        -20, -10, -10,  -5,  -5, -10, -10, -20 ],
+    chess.KING : [
+        -30, -40, -40, -50, -50, -40, -40, -30,
+        -30, -40, -40, -50, -50, -40, -40, -30,
+        -30, -40, -40, -50, -50, -40, -40, -30,
+        -30, -40, -40, -50, -50, -40, -40, -30,
+        -20, -30, -30, -40, -40, -30, -30, -20,
+        -10, -20, -20, -20, -20, -20, -20, -10,
+         20,  20,   0,   0,   0,   0,  20,  20,
+         20,  30,  10,   0,   0,  10,  30,  20 ],
+}
+
+# Piece-square bonus, and value plus bonus, of every (piece type, color, square)
+SQUARE_BONUS = {
+    (pt, color) : [PST[pt][chess.square_mirror(sq) if color else sq] for sq in chess.SQUARES]
+    for pt in chess.PIECE_TYPES for color in chess.COLORS
+}
+SQUARE_VALUES = { k : [VALUES[k[0]] + b for b in bonus] for (k, bonus) in SQUARE_BONUS.items() }
+
+# The same, signed by color and indexed as compactBoard expects (piece + 6, 0x88 square)
+POSITION_VALUES = [[0] * 128 for _ in range(13)]
+for ((pt, color), table) in SQUARE_VALUES.items():
+    for sq in chess.SQUARES:
+        POSITION_VALUES[6 + (pt if color else -pt)][compactBoard.to88(sq)] = table[sq] if color else -table[sq]
+
+class SearchTimeout(Exception):
+    '''
+      Raised inside the search when the hard time limit is reached.
+    '''
+    pass
+
+
+def time_budget(clockSeconds, oppSeconds):
+    '''
+      Time to spend on a move.
+        Input:
+             clockSeconds (our remaining time)
+               oppSeconds (the opponent remaining time)
+
+        Output:
+             (soft, hard) (seconds: no new iteration is started after soft,
+                           the search is interrupted at hard)
+    '''
+    soft = clockSeconds / 40
+    if clockSeconds > oppSeconds:
+        soft += (clockSeconds - oppSeconds) / 20
+
+    hard = min(3 * soft, clockSeconds / 10)
+    return (min(soft, hard), hard)
+
+
+# Bound types of the transposition table entries
+EXACT, LOWER, UPPER = 1, 2, 3
+
+class TranspositionTable(object):
+
+    ENTRY_BYTES = 19
+
+    def __init__(self, megabytes = 16):
+        '''
+          Fixed-size transposition table, stored in preallocated arrays.
+          Entries are replaced if they belong to an older search or were searched
+          to a smaller (or equal) depth; the same position is always replaced.
+            Input:
+                 megabytes (optional, memory budget, rounded down to a power of two entries)
+        '''
+
+        size = 1
+        while 2 * size * self.ENTRY_BYTES <= megabytes * 2**20:
+            size *= 2
+
+        self.size = size
+        self.mask = size - 1
+        self.keys   = array.array('Q', bytes(8 * size))
+        self.scores = array.array('i', bytes(4 * size))
+        self.moves  = array.array('I', bytes(4 * size))
+        self.depths = array.array('b', bytes(size))
+        self.bounds = array.array('b', bytes(size))
+        self.ages   = array.array('B', bytes(size))
+
+        self.age = 0
+        self.used = 0
+        self.probes = 0
+        self.hits = 0
+
+
+    def new_search(self):
+        '''
+          Start a new search: entries of previous searches become replaceable.
+        '''
+        self.age = (self.age + 1) % 256
+
+
+    def probe(self, key):
+        '''
+          Output:
+               (depth, score, bound, move) of the position, or None
+        '''
+        self.probes += 1
+        i = key & self.mask
+        if self.bounds[i] == 0 or self.keys[i] != key:
+            return None
+
+        self.hits += 1
+        return (self.depths[i], self.scores[i], self.bounds[i], self.moves[i] or None)
+
+
+    def store(self, key, depth, score, bound, move):
+        '''
+          Save the result of a search (bound is EXACT, LOWER or UPPER, move is
+          a compactBoard move or None).
+        '''
+        i = key & self.mask
+
+        if self.bounds[i] == 0:
+            self.used += 1
+
+        elif self.keys[i] != key and self.ages[i] == self.age and self.depths[i] > depth:
+            return
+
+        self.keys[i] = key
+        self.depths[i] = depth
+        self.scores[i] = score
+        self.bounds[i] = bound
+        self.ages[i] = self.age
+        self.moves[i] = move or 0
+
+
+    def stats(self):
+        '''
+          Output:
+               dictionary with the hit rate and the fill ratio of the table
+        '''
+        return { 'size' : self.size, 'probes' : self.probes, 'hits' : self.hits,
+                 'hitRate' : self.hits / self.probes if self.probes else 0,
+                 'fill' : self.used / self.size }
 
-STOCKFISH = chess.engine.SimpleEngine.popen_uci('./Stockfish/src/stockfish')
 
 class SimpleEngine(object):
 
-    def __init__(self):
+    def __init__(self, pruning = True, ttMegabytes = 16):
         '''
           SimpleEngine object creator.
+            Input:
+                 pruning (optional, Boolean, if false search the full minimax tree
+                          in generation order, as a reference for benchmarks)
+             ttMegabytes (optional, size of the transposition table, 0 to disable it)
         '''
 
         self.INFTY = 1000000
+        self.pruning = pruning
+
+        # Search statistics of the last call to 'analyse'
+        self.nodes = 0
+        self.cutoffs = 0
+
+        # Quiet moves that caused a cutoff, by remaining depth (killers) and by
+        # (side to move, from square, to square) (history)
+        self.killers = {}
+        self.history = {}
+
+        # Time at which the search must stop (None: no limit)
+        self.deadline = None
+
+        # Kept across calls to 'analyse', so that it persists along a game
+        self.tt = TranspositionTable(ttMegabytes) if ttMegabytes and pruning else None
+
 
     def stockfish(self, board, searchDepth = 10, outputInfo = False, multiPV = 1):
         '''
@@ -31,6 +255,9 @@ class SimpleEngine(object):
         '''
 
         global STOCKFISH
+        if STOCKFISH is None:
+            STOCKFISH = enginePool.EnginePool('./Stockfish/src/stockfish', size = 1)
+
         limit = chess.engine.Limit(depth = searchDepth)
 
         info = STOCKFISH.analyse(board, limit, multipv = multiPV)
@@ -57,6 +284,23 @@ class SimpleEngine(object):
             return output[0]
 
 
+    def static_evaluation(self, board):
+        '''
+          Material and piece-square score of a position, from White's point of
+          view, computed from scratch out of the piece bitboards.
+        '''
+
+        score = 0
+        for pt in chess.PIECE_TYPES:
+            for color in chess.COLORS:
+                mask = board.pieces_mask(pt, color)
+                bonus = SQUARE_BONUS[(pt, color)]
+                total = VALUES[pt] * chess.popcount(mask) + sum(bonus[sq] for sq in chess.scan_forward(mask))
+                score += total if color else -total
+
+        return score
+
+
     def absolute_evaluation(self, board):
 
         if board.is_checkmate():
@@ -65,15 +309,7 @@ class SimpleEngine(object):
         if board.is_stalemate():
             return 0
 
-        sfen = board.fen().split(' ')[0]
-        material = 0
-        material += 100 * (sfen.count('P') - sfen.count('p'))
-        material += 300 * (sfen.count('N') - sfen.count('n'))
-        material += 325 * (sfen.count('B') - sfen.count('b'))
-        material += 500 * (sfen.count('R') - sfen.count('r'))
-        material += 910 * (sfen.count('Q') - sfen.count('q'))
-
-        evaluation = material if board.turn else -material
+        evaluation = self.static_evaluation(board)
 
         if board.is_check():
             evaluation += (-10 if board.turn else +10)
@@ -81,65 +317,252 @@ class SimpleEngine(object):
         return evaluation
 
 
-    def alphabeta(self, board, depth, alpha, beta, maximizingPlayer):
+    def order_moves(self, position, depth, ttMove = None):
+        '''
+          Pseudo-legal moves (compactBoard) sorted so that the most promising ones
+          are searched first: the best move found by a previous search (ttMove),
+          captures (MVV-LVA) and promotions, then killer moves, then quiet moves by
+          history score.
+        '''
+
+        killers = self.killers.get(depth, ())
+        board, turn, history = position.board, position.turn, self.history
+        INFTY = self.INFTY
+
+        def priority(move):
+            if move == ttMove:
+                return 4 * INFTY
+
+            victim = position.captured(move)
+            if victim:
+                attacker = board[move & 127] * turn
+                return 3 * INFTY + 10 * ORDER_VALUES[victim] - ORDER_VALUES[attacker]
+
+            promotion = (move >> 14) & 7
+            if promotion:
+                return 2 * INFTY + ORDER_VALUES[promotion]
+
+            if move in killers:
+                return INFTY + (1 if move == killers[0] else 0)
+
+            return history.get((turn, move & 0x3fff), 0)
+
+        moves = position.generate([])
+        moves.sort(key = priority, reverse = True)
+        return moves
+
 
-#        print(board)
-#        print(self.absolute_evaluation(board))
-#        print()
+    def cutoff(self, position, move, depth):
+        '''
+          Remember a quiet move that caused a beta cutoff.
+        '''
+
+        self.cutoffs += 1
+
+        if position.captured(move) or (move >> 14) & 7:
+            return
+
+        killers = self.killers.setdefault(depth, [])
+        if move not in killers:
+            killers.insert(0, move)
+            del killers[2:]
 
-        if depth == 0 or board.is_game_over():
-            return (self.absolute_evaluation(board), None)
+        key = (position.turn, move & 0x3fff)
+        self.history[key] = self.history.get(key, 0) + depth * depth
+
+
+    def alphabeta(self, position, depth, alpha, beta, maximizingPlayer):
+        '''
+          Alpha-beta search on a compactBoard.Position.
+            Output:
+                 (score in centipawns from White's point of view, best move
+                  (compactBoard move, or None))
+        '''
+
+        self.nodes += 1
+        if self.deadline and self.nodes % 1024 == 0 and time.time() > self.deadline:
+            raise SearchTimeout()
+
+        white = position.turn == compactBoard.WHITE
+
+        # At the leaves, only look for checkmates if we are in check
+        if depth == 0:
+            if position.in_check():
+                if not position.has_legal_move():
+                    return (-self.INFTY if white else self.INFTY, None)
+                return (position.score + (-10 if white else +10), None)
+            return (position.score, None)
+
+        if position.halfmove >= 150 or position.insufficient_material():
+            return (0, None)
+
+        # Look the position up in the transposition table
+        ttMove = None
+        if self.tt:
+            key = position.hash
+            entry = self.tt.probe(key)
+            if entry:
+                (ttDepth, ttScore, bound, ttMove) = entry
+                if ttDepth >= depth and ttMove:
+                    if bound == EXACT or \
+                       (bound == LOWER and ttScore >= beta) or \
+                       (bound == UPPER and ttScore <= alpha):
+                        return (ttScore, ttMove)
+
+            alphaOrig, betaOrig = alpha, beta
 
         best = None
+        legal = False
+        moves = self.order_moves(position, depth, ttMove) if self.pruning else position.generate([])
 
         if maximizingPlayer:
-            value = -self.INFTY
+            value = -self.INFTY - 1
+
+            for move in moves:
+                position.make(move)
+                if position.illegal():
+                    position.unmake()
+                    continue
 
-            for move in board.legal_moves:
-                board.push(move)
-                (v, ponder) = self.alphabeta(board, depth-1, alpha, beta, False)
-                board.pop()
+                legal = True
+                (v, ponder) = self.alphabeta(position, depth-1, alpha, beta, False)
+                position.unmake()
 
-                if v >= value:
+                if v > value:
                     value = v
                     best = move
 
-            return (value, best)
+                if self.pruning:
+                    alpha = max(alpha, value)
+                    if alpha >= beta:
+                        self.cutoff(position, move, depth)
+                        break
 
         else:
-            value = +self.INFTY
+            value = +self.INFTY + 1
+
+            for move in moves:
+                position.make(move)
+                if position.illegal():
+                    position.unmake()
+                    continue
 
-            for move in board.legal_moves:
-                board.push(move)
-                (v, ponder) = self.alphabeta(board, depth-1, alpha, beta, True)
-                board.pop()
+                legal = True
+                (v, ponder) = self.alphabeta(position, depth-1, alpha, beta, True)
+                position.unmake()
 
-                if v <= value:
+                if v < value:
                     value = v
                     best = move
 
-            return (value, best)
+                if self.pruning:
+                    beta = min(beta, value)
+                    if alpha >= beta:
+                        self.cutoff(position, move, depth)
+                        break
+
+        # No legal moves: checkmate or stalemate
+        if not legal:
+            if position.in_check():
+                return (-self.INFTY if white else self.INFTY, None)
+            return (0, None)
+
+        if self.tt:
+            bound = UPPER if value <= alphaOrig else LOWER if value >= betaOrig else EXACT
+            self.tt.store(key, depth, value, bound, best)
+
+        return (value, best)
+
+
+    def prepare(self, board):
+        '''
+          Reset the per-search state before searching a new position.
+            Output:
+                 position (compactBoard.Position type, the board to search on)
+        '''
+
+        self.nodes = 0
+        self.cutoffs = 0
+        self.killers = {}
+        if self.tt:
+            self.tt.new_search()
+        return compactBoard.Position(board, POSITION_VALUES)
 
 
     def analyse(self, board, depth):
-        return self.alphabeta(board, depth, -self.INFTY, +self.INFTY, board.turn)
+        '''
+          Search a position to a fixed depth.
+            Input:
+                 board (chess.Board type, from python-chess)
+                 depth (int: depth in plies)
+
+            Output:
+                 (score in centipawns from White's point of view, best move)
+        '''
+
+        position = self.prepare(board)
+        (value, best) = self.alphabeta(position, depth, -self.INFTY, +self.INFTY, board.turn)
+        return (value, position.to_move(best) if best else None)
 
 
-    def weak_engine(moves):
+    def search(self, board, soft, hard, maxDepth = 64):
+        '''
+          Iterative deepening search: search to depth 1, 2, ... until the soft time
+          limit, interrupting the last iteration at the hard time limit. Each
+          iteration starts from the moves found by the previous one (through the
+          transposition table, killers and history).
+            Input:
+                 board (chess.Board type, from python-chess, left unchanged)
+                  soft (seconds after which no new iteration is started)
+                  hard (seconds after which the search is interrupted)
+              maxDepth (optional, maximum depth in plies)
+
+            Output:
+                 (score in centipawns from White's point of view, best move,
+                  depth of the last completed iteration)
+        '''
+
+        start = time.time()
+        position = self.prepare(board)
+        result = (None, None, 0)
+
+        for depth in range(1, maxDepth + 1):
+
+            # The first iteration always completes, so that we have a move
+            self.deadline = start + hard if depth > 1 else None
+
+            try:
+                (value, best) = self.alphabeta(position, depth, -self.INFTY, +self.INFTY, board.turn)
+
+            except SearchTimeout:
+                break
+
+            finally:
+                self.deadline = None
+
+            result = (value, position.to_move(best) if best else None, depth)
+
+            if time.time() - start > soft or abs(value) >= self.INFTY:
+                break
+
+        return result
+
+
+    def weak_engine(self, moves):
         '''
           Weak engine that picks a move
             Input:
-                 board (chess.Board type, from python-chess)
+                 moves (string list of game moves (UCI format))
 
             Output:
-                 move (chess.Move.from_uci type, from python-chess)
+                 move (string: move in UCI format)
         '''
 
         b = chess.Board()
-        for move in moves.split(' '):
+        for move in moves:
             b.push_uci(move)
 
-        moves = stockfish(b, searchDepth = 10, outputInfo = True, multiPV = 9)
+        moves = self.stockfish(b, searchDepth = 10, outputInfo = True, multiPV = 9)
         refScore = moves[0]['score']
 
         N = 0
@@ -153,9 +576,250 @@ class SimpleEngine(object):
         return str(moves[i]['move'])
 
 
-e = SimpleEngine()
-b = chess.Board('rnbqkb1r/pppppppp/5n2/8/4P3/8/PPPP1PPP/RNBQKBNR w KQkq - 1 2')
+# Engine of each worker process of ParallelEngine, kept warm between searches
+WORKER_ENGINE = None
+
+def init_worker(ttMegabytes):
+    global WORKER_ENGINE
+    WORKER_ENGINE = SimpleEngine(ttMegabytes = ttMegabytes)
+
+
+def search_root_moves(board, moves, depth, deadline, bound = None):
+    '''
+      Search some root moves of a position in a worker process.
+        Input:
+                board (chess.Board type, from python-chess)
+                moves (string list of root moves (UCI format))
+                depth (int: depth in plies, counting the root move)
+             deadline (time at which the search must stop, or None)
+                bound (optional, score already reached by another root move:
+                       only moves that improve on it are searched exactly)
+
+        Output:
+             (score of the best of the moves, best move (UCI format), nodes),
+             or None if the deadline was reached
+    '''
+
+    engine = WORKER_ENGINE
+    position = engine.prepare(board)
+    engine.deadline = deadline
+    maximizing = board.turn
+
+    alpha, beta = -engine.INFTY - 1, engine.INFTY + 1
+    value, best = (alpha if maximizing else beta), None
+
+    if bound is not None:
+        if maximizing:
+            alpha = bound
+        else:
+            beta = bound
+
+    try:
+        for uci in moves:
+            position.make(position.from_move(chess.Move.from_uci(uci)))
+            (v, ponder) = engine.alphabeta(position, depth - 1, alpha, beta, not maximizing)
+            position.unmake()
+
+            if (v > value) if maximizing else (v < value):
+                value, best = v, uci
+                if maximizing:
+                    alpha = max(alpha, value)
+                else:
+                    beta = min(beta, value)
+
+    except SearchTimeout:
+        return None
+
+    finally:
+        engine.deadline = None
+
+    return (value, best, engine.nodes)
+
+
+class ParallelEngine(object):
+
+    def __init__(self, workers = None, ttMegabytes = 16, margin = 50):
+        '''
+          Root-parallel version of SimpleEngine: the root moves are split among
+          worker processes, each one holding its own warm SimpleEngine (and
+          transposition table), and the results are merged. The search state is
+          kept per call, so several games (threads) can share the engine.
+            Input:
+                  workers (optional, number of processes, one per core by default)
+              ttMegabytes (optional, size of the transposition table of every worker)
+                   margin (optional, centipawns below the score of the previous
+                           iteration from which the other root moves are searched
+                           exactly, while the first one is being searched)
+        '''
+
+        self.workers = workers or os.cpu_count() or 1
+        self.margin = margin
+        self.executor = concurrent.futures.ProcessPoolExecutor(
+            max_workers = self.workers, initializer = init_worker, initargs = (ttMegabytes,))
+
+        # Used in this process to order the root moves
+        self.engine = SimpleEngine(ttMegabytes = 0)
+        self.lock = threading.Lock()
+
+        # Nodes of the last search of each thread
+        self.last = threading.local()
+
+
+    @property
+    def nodes(self):
+        '''
+          Nodes searched by the last search of the calling thread.
+        '''
+        return getattr(self.last, 'nodes', 0)
+
+
+    def search_depth(self, board, depth, deadline = None, hint = None, score = None):
+        '''
+          Search a position to a fixed depth. All the root moves are searched
+          at once: the most promising one on its own, and the others split among
+          the workers (in order, so that every worker gets some promising moves).
+          The others only need to be searched exactly if they beat the first
+          one, so, given the score of the previous iteration, they are searched
+          with a bound 'margin' centipawns worse than it. If the first move ends
+          up below that bound, the chunks that failed low are searched again
+          with its actual score.
+            Input:
+                 board (chess.Board type, from python-chess)
+                 depth (int: depth in plies)
+              deadline (optional, time at which the search must stop)
+                  hint (optional, chess.Move type: best move of the previous iteration)
+                 score (optional, score of the previous iteration, from White's point of view)
+
+            Output:
+                 (score in centipawns from White's point of view, best move, nodes),
+                 or None if the deadline was reached
+        '''
+
+        position = compactBoard.Position(board)
+        with self.lock:
+            ttMove = position.from_move(hint) if hint else None
+            moves = [position.to_move(m) for m in self.engine.order_moves(position, depth, ttMove)]
+            moves = [m.uci() for m in moves if board.is_legal(m)]
+            if not moves:
+                (value, best) = self.engine.analyse(board, 1)
+                return (value, best, 0)
+
+        sign = 1 if board.turn else -1
+        bound = None if score is None else score - sign * self.margin
+
+        first = self.executor.submit(search_root_moves, board, moves[:1], depth, deadline)
+        chunks = [moves[1:][i::self.workers] for i in range(self.workers)]
+        chunks = [chunk for chunk in chunks if chunk]
+        futures = [self.executor.submit(search_root_moves, board, chunk, depth, deadline, bound)
+                   for chunk in chunks]
+
+        first = first.result()
+        results = [f.result() for f in futures]
+        if first is None or None in results:
+            return None
+        nodes = first[2] + sum(r[2] for r in results)
+
+        # A chunk searched with a bound better than the first move's score
+        # only proves that its moves are not better than the bound
+        if bound is not None and sign * first[0] < sign * bound:
+            again = [i for (i, r) in enumerate(results) if sign * r[0] <= sign * bound]
+            futures = [(i, self.executor.submit(search_root_moves, board, chunks[i], depth, deadline,
+                                                first[0])) for i in again]
+            for (i, future) in futures:
+                results[i] = future.result()
+                if results[i] is None:
+                    return None
+                nodes += results[i][2]
+
+        # On a tie the first move is kept (the others may be bounds)
+        pick = max if board.turn else min
+        (value, best, _) = pick([first] + results, key = lambda r: r[0])
+        return (value, chess.Move.from_uci(best), nodes)
+
+
+    def analyse(self, board, depth):
+        '''
+          Search a position to a fixed depth (as SimpleEngine.analyse).
+        '''
+
+        found = self.search_depth(board, depth)
+        self.last.nodes = found[2]
+        return found[:2]
+
+
+    def search(self, board, soft, hard, maxDepth = 64):
+        '''
+          Iterative deepening with a soft and a hard time limit (as SimpleEngine.search).
+        '''
+
+        start = time.time()
+        nodes = 0
+        result = (None, None, 0)
+
+        for depth in range(1, maxDepth + 1):
+            found = self.search_depth(board, depth, start + hard if depth > 1 else None,
+                                      hint = result[1], score = result[0])
+            if found is None:
+                break
+
+            nodes += found[2]
+            result = (found[0], found[1], depth)
+            if time.time() - start > soft or abs(found[0]) >= self.engine.INFTY:
+                break
+
+        self.last.nodes = nodes
+        return result
+
+
+    def close(self):
+        '''
+          Stop the worker processes.
+        '''
+        self.executor.shutdown()
+
+
+def selector(engine = None, ttMegabytes = 4):
+    '''
+      Build a moveSelector for myBot.Bot that plays with SimpleEngine (no Stockfish
+      needed), spending on each move the time given by 'time_budget'.
+        Input:
+                  engine (optional, ParallelEngine shared by all the games; by default
+                          every game gets its own SimpleEngine, kept in its GameSession,
+                          since the search state of a SimpleEngine cannot be shared by
+                          concurrent games)
+             ttMegabytes (optional, transposition table of each per-game SimpleEngine)
+
+        Output:
+             moveSelector (function (board, clockSeconds, oppSeconds, session) -> (move, msg))
+    '''
+
+    if isinstance(engine, SimpleEngine):
+        raise ValueError('a SimpleEngine cannot be shared by the games, use a ParallelEngine')
+
+    @myBot.session_selector
+    def simple_engine(board, clockSeconds, oppSeconds, session):
+        if engine:
+            searcher = engine
+        else:
+            searcher = session.engine = session.engine or SimpleEngine(ttMegabytes = ttMegabytes)
+
+        (soft, hard) = time_budget(clockSeconds, oppSeconds)
+        with botMetrics.span('engine'):
+            (value, best, depth) = searcher.search(board, soft, hard)
+        botMetrics.count('engineNodes', searcher.nodes)
+        print("SimpleEngine: depth %d, score %d, %d nodes" % (depth, value, searcher.nodes), flush = True)
+        return str(best), None
+
+    return simple_engine
+
+
+if __name__ == '__main__':
+
+    e = SimpleEngine()
+    b = chess.Board('rnbqkb1r/pppppppp/5n2/8/4P3/8/PPPP1PPP/RNBQKBNR w KQkq - 1 2')
 
-print (e.analyse(b, 4))
+    print (e.analyse(b, 4))
+    print ("Nodes:", e.nodes, "Cutoffs:", e.cutoffs)
 
-STOCKFISH.close()
+    if STOCKFISH:
+        STOCKFISH.close()
@@ -0,0 +1,47 @@
+import random
+
+import chess
+import chess.polyglot
+import pytest
+
+import compactBoard
+import simpleEngine
+
+
+def test_perft_matches_python_chess():
+    assert compactBoard.check_perft(depth = 3)
+
+
+@pytest.mark.parametrize('fen', compactBoard.PERFT_FENS)
+def test_incremental_hash_matches_polyglot(fen):
+    rand = random.Random(fen)
+    board = chess.Board(fen)
+    position = compactBoard.Position(board)
+    hashes = [position.hash]
+
+    for _ in range(40):
+        moves = list(board.legal_moves)
+        if not moves:
+            break
+        move = rand.choice(moves)
+        position.make(position.from_move(move))
+        board.push(move)
+        assert position.hash == chess.polyglot.zobrist_hash(board), board.fen()
+        hashes.append(position.hash)
+
+    # Unmaking restores every previous key
+    while board.move_stack:
+        hashes.pop()
+        position.unmake()
+        board.pop()
+        assert position.hash == hashes[-1] == chess.polyglot.zobrist_hash(board)
+
+
+@pytest.mark.parametrize('fen', compactBoard.PERFT_FENS)
+def test_alphabeta_matches_minimax(fen):
+    board = chess.Board(fen)
+    (pruned, best) = simpleEngine.SimpleEngine().analyse(board, 3)
+    (minimax, _) = simpleEngine.SimpleEngine(pruning = False).analyse(board, 3)
+
+    assert pruned == minimax
+    assert best in board.legal_moves